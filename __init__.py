@@ -7,12 +7,16 @@ __author__ = "renan.lino@gmail.com"
 
 from .types import (Update, User, Chat, Message, PhotoSize,
 					Audio, Voice, Document, Sticker, Video, Contact,
-					Location, InputFile, UserProfilePhotos, File,
+					Location, InputFile, InputMedia, UserProfilePhotos, File,
 					ReplyKeyboardMarkup, ReplyKeyboardHide, ForceReply)
+from .types import selectPhotoSize
 from .bot import Bot
+from .cache import MediaCache
+from .errors import (TelegramError, NetworkError, BadRequest, ChatMigrated, Unauthorized,
+					Forbidden, ChatBlocked, NotFound, Conflict, RetryAfter, ServerError)
 from ._aux import openFile
 
 __all__ = [Update, User, Chat, Message, PhotoSize,
 					Audio, Voice, Document, Sticker, Video, Contact,
-					Location, InputFile, UserProfilePhotos, File,
+					Location, InputFile, InputMedia, UserProfilePhotos, File,
 					ReplyKeyboardMarkup, ReplyKeyboardHide, ForceReply]
@@ -1,3 +1,5 @@
+import logging
+
 def openFile(filepath, Mode="r"):
     """"
     (str, str) -> file object
@@ -6,7 +8,27 @@ def openFile(filepath, Mode="r"):
     """
     try:
         fileObj = open(filepath, mode=Mode)
-    except IOError:
-        print("Warning: IOError while trying to open %s!" %filepath)
+    except IOError as error:
+        logging.warning("openFile(): IOError while trying to open %s: %s" %(filepath, error))
         return None
     return fileObj
+
+
+class LazyModule:
+    """
+    Stand-in for a module that is only imported on first attribute access.
+    Used to keep heavy dependencies (requests) out of the package import time.
+    """
+    def __init__(self, name):
+        """
+        (str) -> constructor
+        LazyModule class constructor. 'name' is the module to import.
+        """
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute):
+        if self._module is None:
+            import importlib
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attribute)
@@ -0,0 +1,138 @@
+"""
+Asynchronous chat actions ("typing", "upload_photo"...) for the Bot class.
+"""
+
+from contextlib import contextmanager
+import logging
+import queue
+import threading
+import time
+
+#Telegram shows a chat action for 5 seconds (or until a message is sent)
+ACTION_VALIDITY = 5.0
+#re-send an action this often while an upload is still running
+ACTION_REFRESH = 4.0
+
+
+class ChatActionManager:
+    """
+    Sends chat actions from a background thread, so callers never wait for them.
+    An action already shown in a chat is not sent again while it is still valid,
+    and actions held with keep() are refreshed until the surrounding work finishes.
+
+        Attribute        Type        Description
+        bot              Bot         bot used to send the actions
+        validity         float       seconds an action stays visible after being sent
+        refresh          float       interval between refreshes of held actions
+        sent             int         number of actions actually sent
+        suppressed       int         number of actions skipped because they were still visible
+    """
+    def __init__(self, bot, validity=ACTION_VALIDITY, refresh=ACTION_REFRESH):
+        """
+        (Bot, float, float) -> constructor
+        ChatActionManager class constructor.
+        """
+        self.bot = bot
+        self.validity = validity
+        self.refresh = refresh
+        self.sent = 0
+        self.suppressed = 0
+        #(chat id, action) -> time the action was last sent
+        self._lastSent = {}
+        #(chat id, action) -> [chat, next refresh time, number of holders]
+        self._held = {}
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def send(self, to, action):
+        """
+        (User/Chat, string) -> bool
+        Queue a chat action. Returns False if the same action is still visible in
+        this chat and the request was dropped.
+        """
+        if not self._claim(to, action):
+            return False
+        self._queue.put( (to, action) )
+        return True
+
+    def _claim(self, to, action):
+        #record that 'action' is about to be sent; False if it is still visible
+        key = (to.id, action)
+        now = time.monotonic()
+        with self._lock:
+            if now - self._lastSent.get(key, -self.validity) < self.validity:
+                self.suppressed += 1
+                return False
+            self._lastSent[key] = now
+            if len(self._lastSent) > 4096:
+                self._lastSent = {k: t for k, t in self._lastSent.items() if now - t < self.validity}
+            self._startWorker()
+        return True
+
+    @contextmanager
+    def keep(self, to, action):
+        """
+        (User/Chat, string) -> context manager
+        Show 'action' in the chat for as long as the 'with' block runs. Every action,
+        the first one included, is sent by the background worker, so the caller never
+        waits for it: a fast upload may reach Telegram before its action, which is then
+        shown briefly or not at all. Blocks repeated while the action is still visible
+        (back to back uploads) do not send it again.
+        """
+        key = (to.id, action)
+        self.send(to, action)
+        with self._lock:
+            if key in self._held:
+                self._held[key][2] += 1
+            else:
+                self._held[key] = [to, self._lastSent.get(key, time.monotonic()) + self.refresh, 1]
+        #wake the worker so it takes the new refresh time into account
+        self._queue.put(None)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._held[key][2] -= 1
+                if self._held[key][2] == 0:
+                    del self._held[key]
+
+    def _startWorker(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name="ChatActionManager", daemon=True)
+            self._worker.start()
+
+    def _nextRefresh(self):
+        with self._lock:
+            if not self._held:
+                return None
+            return max(0.0, min(entry[1] for entry in self._held.values()) - time.monotonic())
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self._nextRefresh())
+            except queue.Empty:
+                item = None
+            if item is not None:
+                self._send(*item)
+
+            now = time.monotonic()
+            due = []
+            with self._lock:
+                for key, entry in self._held.items():
+                    if entry[1] <= now:
+                        entry[1] = now + self.refresh
+                        self._lastSent[key] = now
+                        due.append( (entry[0], key[1]) )
+            for to, action in due:
+                self._send(to, action)
+
+    def _send(self, to, action):
+        try:
+            if self.bot.sendChatAction(to, action) is None:
+                logging.info("ChatActionManager: could not send %s to chat %s." %(action, to.id))
+            else:
+                self.sent += 1
+        except Exception:
+            logging.exception("ChatActionManager: error while sending %s." %action)
@@ -0,0 +1,92 @@
+"""
+Location index benchmark: build time, radius and k-nearest query latency at 1M points,
+against a linear scan. The R-tree backend is measured too when rtree is installed.
+
+    python benchmarks/geo_index.py [points] [queries]
+"""
+
+import importlib
+import os
+import random
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE = os.path.basename(ROOT)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def timeQueries(function, queries):
+    times = []
+    for query in queries:
+        start = time.perf_counter()
+        function(query)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def report(name, times):
+    print("  %-28s median %8.3f ms   p99 %8.3f ms" %(
+        name, statistics.median(times) * 1000, percentile(times, 0.99) * 1000))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    queryCount = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    sys.path.insert(0, os.path.dirname(ROOT))
+    geo = importlib.import_module(PACKAGE + ".geo")
+    types = importlib.import_module(PACKAGE + ".types")
+
+    random.seed(42)
+    #users clustered around a few hundred cities, as real traffic would be
+    cities = [(random.uniform(-60, 70), random.uniform(-180, 180)) for _ in range(300)]
+    points = []
+    for _ in range(count):
+        latitude, longitude = random.choice(cities)
+        points.append(types.Location({"latitude":max(-90.0, min(90.0, latitude + random.gauss(0, 0.3))),
+                                      "longitude":(longitude + random.gauss(0, 0.3) + 180.0) % 360.0 - 180.0}))
+    queries = []
+    for _ in range(queryCount):
+        latitude, longitude = random.choice(cities)
+        queries.append(types.Location({"latitude":latitude + random.gauss(0, 0.5), "longitude":longitude}))
+
+    backends = [("grid", False)]
+    try:
+        import rtree
+        backends.append(("rtree", True))
+    except ImportError:
+        print("rtree is not installed: R-tree backend skipped")
+
+    print("%d points, %d queries" %(count, queryCount))
+    for name, useRtree in backends:
+        index = geo.LocationIndex(use_rtree=useRtree)
+        start = time.perf_counter()
+        for key, location in enumerate(points):
+            index.update(key, location)
+        print("%s: built in %.2f s" %(name, time.perf_counter() - start))
+        report("within 5 km", timeQueries(lambda query: index.within(query, 5000), queries))
+        report("nearest 10", timeQueries(lambda query: index.nearest(query, 10), queries))
+        #moving users: remove and insert again
+        moves = [(random.randrange(count), queries[i % queryCount]) for i in range(10000)]
+        start = time.perf_counter()
+        for key, location in moves:
+            index.update(key, location)
+        print("  %-28s %8.3f us per update" %("move", (time.perf_counter() - start) / len(moves) * 1e6))
+
+    coordinates = [(location.latitude, location.longitude) for location in points]
+
+    def scan(query):
+        return sorted((geo.haversine(query.latitude, query.longitude, latitude, longitude), key)
+                      for key, (latitude, longitude) in enumerate(coordinates))[:10]
+    print("linear scan:")
+    report("nearest 10", timeQueries(scan, queries[:5]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+User/Chat interning benchmark: memory held by parsed group traffic with and without
+the identity maps of types.py, measured with tracemalloc, and parse time (best of 3
+runs, timed without tracemalloc, which slows allocations down).
+
+    python benchmarks/interning.py [messages] [users] [chats]
+"""
+
+import gc
+import importlib
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE = os.path.basename(ROOT)
+
+
+def groupTraffic(count, users, chats):
+    """
+    Raw updates of busy groups: a few active members write most of the messages.
+    """
+    random.seed(7)
+    people = [{"id":100000 + index, "first_name":"User%d" %index, "last_name":"Surname%d" %index,
+               "username":"user_%d" %index} for index in range(users)]
+    groups = [{"id":-100000 - index, "type":"supergroup", "title":"Group number %d" %index}
+              for index in range(chats)]
+    weights = [1.0 / (rank + 1) for rank in range(users)]
+    senders = random.choices(people, weights, k=count)
+    updates = []
+    for index, sender in enumerate(senders):
+        updates.append({"update_id":index, "message":{"message_id":index, "date":1700000000 + index,
+                                                      "from":dict(sender), "chat":dict(random.choice(groups)),
+                                                      "text":"message %d" %index}})
+    return updates
+
+
+def measure(types, updates, intern):
+    types.INTERN = intern
+    elapsed = None
+    for run in range(3):
+        gc.collect()
+        start = time.perf_counter()
+        messages = [types.Update(update).message for update in updates]
+        run = time.perf_counter() - start
+        elapsed = run if elapsed is None else min(elapsed, run)
+        del messages
+    gc.collect()
+    tracemalloc.start()
+    messages = [types.Update(update).message for update in updates]
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    distinct = len({id(message.from_user) for message in messages}) + len({id(message.chat) for message in messages})
+    del messages
+    return size, elapsed, distinct
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    users = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    chats = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+
+    sys.path.insert(0, os.path.dirname(ROOT))
+    types = importlib.import_module(PACKAGE + ".types")
+    updates = groupTraffic(count, users, chats)
+
+    print("%d messages from %d users in %d chats" %(count, users, chats))
+    results = {}
+    times = {}
+    for intern in (False, True):
+        size, elapsed, distinct = measure(types, updates, intern)
+        results[intern] = size
+        times[intern] = elapsed
+        print("  interning %-5s  %8.1f MB   %6.2f s to parse   %7d User/Chat objects" %(
+            intern, size / 1e6, elapsed, distinct))
+    saved = results[False] - results[True]
+    print("  saved %.1f MB (%.0f%%, %.0f bytes per message)" %(
+        saved / 1e6, 100.0 * saved / results[False], saved / count))
+    print("  parse time %+.0f%% with interning" %(100.0 * (times[True] - times[False]) / times[False]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Startup benchmark: package import time and time to first request.
+
+Each measurement runs in a fresh interpreter. Requests go to a local stub of the
+Bot API, so the numbers do not depend on the network to api.telegram.org.
+
+    python benchmarks/startup.py [runs]
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE = os.path.basename(ROOT)
+
+ME = {"id": 1, "first_name": "Benchmark", "username": "benchmark_bot"}
+
+
+class StubAPI(BaseHTTPRequestHandler):
+    """
+    Minimal Bot API answering getMe and sendMessage.
+    """
+    def do_GET(self):
+        method = self.path.split("?")[0].rsplit("/", 1)[-1]
+        if method == "getMe":
+            result = ME
+        else:
+            result = {"message_id": 1, "from": ME, "date": 0,
+                      "chat": {"id": 1, "type": "private"}, "text": "ok"}
+        body = json.dumps({"ok": True, "result": result}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_POST = do_GET
+
+    def log_message(self, *args):
+        pass
+
+
+IMPORT_ONLY = """
+import sys, time
+sys.path.insert(0, {parent!r})
+start = time.perf_counter()
+import {package}
+print(time.perf_counter() - start)
+"""
+
+FIRST_REQUEST = """
+import sys, time
+sys.path.insert(0, {parent!r})
+start = time.perf_counter()
+import {package}
+from {package} import bot as botModule
+botModule.API_URL = {api!r}
+bot = {package}.Bot("TOKEN", {options})
+bot.sendMessage({package}.Chat({{"id": 1, "type": "private"}}), "hello")
+print(time.perf_counter() - start)
+"""
+
+
+def measure(script, runs):
+    times = []
+    for run in range(runs):
+        output = subprocess.check_output([sys.executable, "-c", script])
+        times.append(float(output))
+    return statistics.median(times) * 1000, min(times) * 1000
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubAPI)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api = "http://127.0.0.1:%d/bot" % server.server_address[1]
+    parent = os.path.dirname(ROOT)
+    identity = os.path.join(tempfile.mkdtemp(), "identity.json")
+
+    cases = [
+        ("import", IMPORT_ONLY.format(parent=parent, package=PACKAGE)),
+        ("first request, eager getMe", FIRST_REQUEST.format(parent=parent, package=PACKAGE, api=api, options="")),
+        ("first request, lazy", FIRST_REQUEST.format(parent=parent, package=PACKAGE, api=api, options="lazy=True")),
+        ("first request, identity file", FIRST_REQUEST.format(parent=parent, package=PACKAGE, api=api,
+                                                              options="identity_file=%r" % identity)),
+    ]
+    print("%-32s %12s %12s" % ("case", "median ms", "min ms"))
+    for name, script in cases:
+        median, best = measure(script, runs)
+        print("%-32s %12.1f %12.1f" % (name, median, best))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Transport benchmark: throughput and number of TCP connections for many concurrent
+sendMessage calls, with the requests transport (HTTP/1.1) and the httpx transport
+over HTTP/1.1 and HTTP/2, against local stub servers adding the same latency to
+every request. Skipped if httpx or h2 are not installed.
+
+    python benchmarks/transport.py [calls] [threads] [latency ms]
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import importlib
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE = os.path.basename(ROOT)
+
+RESULT = json.dumps({"ok": True, "result": {"message_id": 1, "date": 0, "text": "ok",
+                                            "from": {"id": 1, "first_name": "Benchmark"},
+                                            "chat": {"id": 1, "type": "private"}}}).encode("utf-8")
+
+
+class StubHTTP1(BaseHTTPRequestHandler):
+    """
+    Bot API stub speaking HTTP/1.1 with keep-alive.
+    """
+    protocol_version = "HTTP/1.1"
+    latency = 0.0
+    connections = 0
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        type(self).connections += 1
+
+    def do_GET(self):
+        #read the body of POST requests, or it would be taken for the next request
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.latency)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(RESULT)))
+        self.end_headers()
+        self.wfile.write(RESULT)
+
+    do_POST = do_GET
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubHTTP2:
+    """
+    Bot API stub speaking HTTP/2 without TLS (prior knowledge). Each connection is
+    served by one thread; responses are sent 'latency' seconds after each request,
+    so concurrent streams of a connection overlap.
+    """
+    def __init__(self, latency):
+        import h2.config
+        import h2.connection
+        import h2.events
+        self._h2 = h2
+        self.latency = latency
+        self.connections = 0
+        self._socket = socket.socket()
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind(("127.0.0.1", 0))
+        self._socket.listen(128)
+        self.port = self._socket.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            client, address = self._socket.accept()
+            self.connections += 1
+            threading.Thread(target=self._serve, args=(client,), daemon=True).start()
+
+    def _serve(self, client):
+        h2 = self._h2
+        connection = h2.connection.H2Connection(config=h2.config.H2Configuration(client_side=False))
+        lock = threading.Lock()
+        connection.initiate_connection()
+        client.sendall(connection.data_to_send())
+
+        def respond(stream_id):
+            with lock:
+                connection.send_headers(stream_id, [(":status", "200"), ("content-type", "application/json"),
+                                                    ("content-length", str(len(RESULT)))])
+                connection.send_data(stream_id, RESULT, end_stream=True)
+                client.sendall(connection.data_to_send())
+
+        while True:
+            data = client.recv(65536)
+            if not data:
+                return
+            with lock:
+                for event in connection.receive_data(data):
+                    if isinstance(event, h2.events.DataReceived):
+                        connection.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+                    elif isinstance(event, h2.events.StreamEnded):
+                        timer = threading.Timer(self.latency, respond, (event.stream_id,))
+                        timer.daemon = True
+                        timer.start()
+                client.sendall(connection.data_to_send())
+
+
+def run(package, transport, port, calls, threads):
+    bot = package.Bot("123:benchmark", lazy=True, transport=transport)
+    bot.apiURL = "http://127.0.0.1:%d/bot%s/" %(port, bot.token)
+    chat = package.Chat({"id": 1, "type": "private"})
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        results = list(executor.map(lambda index: bot.sendMessage(chat, "message %d" %index), range(calls)))
+    elapsed = time.perf_counter() - start
+    transport.close()
+    failed = sum(1 for result in results if result is None)
+    return calls / elapsed, failed
+
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+    latency = (float(sys.argv[3]) if len(sys.argv) > 3 else 20.0) / 1000
+
+    try:
+        import h2
+        import httpx
+    except ImportError as error:
+        print("skipped: %s (pip install httpx[http2])" %error)
+        return
+
+    sys.path.insert(0, os.path.dirname(ROOT))
+    package = importlib.import_module(PACKAGE)
+    transports = importlib.import_module(PACKAGE + ".transport")
+
+    StubHTTP1.latency = latency
+    http1 = ThreadingHTTPServer(("127.0.0.1", 0), StubHTTP1)
+    http1.daemon_threads = True
+    threading.Thread(target=http1.serve_forever, daemon=True).start()
+    http2 = StubHTTP2(latency)
+
+    print("%d sendMessage calls from %d threads, %.0f ms server latency" %(calls, threads, latency * 1000))
+    print("%-28s %10s %12s %8s" %("transport", "calls/s", "connections", "failed"))
+    cases = [("requests, HTTP/1.1", lambda: transports.RequestsTransport(), http1, True),
+             ("httpx, HTTP/1.1", lambda: transports.HTTPXTransport(http2=False, max_connections=threads), http1, True),
+             ("httpx, HTTP/2", lambda: transports.HTTPXTransport(http1=False, http2=True), http2, False)]
+    for name, makeTransport, server, isHTTP1 in cases:
+        before = StubHTTP1.connections if isHTTP1 else server.connections
+        port = server.server_address[1] if isHTTP1 else server.port
+        throughput, failed = run(package, makeTransport(), port, calls, threads)
+        after = StubHTTP1.connections if isHTTP1 else server.connections
+        print("%-28s %10.0f %12d %8d" %(name, throughput, after - before, failed))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,35 @@
-import requests
 from datetime import datetime
 from .types import (Update, User, Chat, Message, PhotoSize,
                     Audio, Document, Sticker, Video, Contact,
-                    Location, InputFile, UserProfilePhotos)
+                    Location, UserProfilePhotos, File)
 from ._aux import *
+from .cache import TTLCache, SingleFlight
+from .actions import ChatActionManager
+from .transport import RequestsTransport, TransportError
+from .errors import (TelegramError, NetworkError, Unauthorized, Forbidden, ChatBlocked,
+                     RetryAfter, NotFound, errorFromResponse)
 import json
 import logging
-import ast
+import os
+import shutil
+import threading
+import time
+from contextlib import nullcontext
 
 GLOBAL_TIMEOUT = 10
+API_URL = "https://api.telegram.org/bot"
+FILE_URL = "https://api.telegram.org/file/bot"
+#download links returned by getFile are valid for at least one hour
+FILE_LINK_TTL = 55 * 60
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+#chats that blocked the bot are not contacted again for this long (or until they write to it)
+BLOCKED_CHAT_TTL = 24 * 60 * 60
+#after a failed lazy getMe, reading 'me' does not request it again for this long
+IDENTITY_RETRY_DELAY = 30
+#profile photos change rarely: pages of getUserProfilePhotos are reused for this long
+PROFILE_PHOTOS_TTL = 10 * 60
+#requests per second of getUserProfilePhotosBulk (Telegram allows about 30 in total)
+PROFILE_PHOTOS_RATE = 20
 #requests.packages.urllib3.disable_warnings()
 
 class Bot:
@@ -23,39 +44,218 @@ class Bot:
         token            string      token provided by Botfather for your bot
         apiURL           string      base URL for API access
         messages         [Message]   array with messages sent for this bot
-        success          bool        check if the boy was successfully started
-        me               User        information about this bot
+        success          bool        check if the boy was successfully started (resolves 'me' if needed)
+        me               User        information about this bot (requested on first access if lazy)
         vars             dict        general purpose dictionary, available to you set any internal variable
         offset           int         (ID + 1) of last received message from server. to avoid duplicates.
         auto_status      bool        set True for auto send chat status while uploading objects
+        raise_errors     bool        set True to raise TelegramError exceptions instead of returning None
     """
-    def __init__(self, token, offset=0, auto_status=False):
+    def __init__(self, token, offset=0, auto_status=False, media_cache=None,
+                 upload_workers=2, upload_bandwidth=None, send_workers=4,
+                 lazy=False, identity_file=None, validate=False, dedup=None, raise_errors=False,
+                 jobs_file=None, transport=None):
         """
-        (str, int, bool) -> constructor
+        (str, int, bool, MediaCache, int, float, int, bool, str, bool, MemoryStore/FileStore, bool, str, Transport) -> constructor
         Bot class constructor. Initializes a bot object with provided token.
+        If a 'media_cache' is provided, downloaded files are kept there and repeated
+        downloads of the same file are served from disk.
+        'upload_workers' and 'upload_bandwidth' (bytes/s) limit background uploads (see submit),
+        'send_workers' limits the other background calls.
+        By default getMe is called here. With 'lazy' True it is only called the first time
+        'me' (or 'success') is read. With an 'identity_file', the bot information is saved
+        there and reused by later instances with the same token, without calling getMe;
+        set 'validate' True to still check it with getMe from a background thread.
+        With a 'dedup' store (see dedup.py), updates already handled by this or another bot
+        object with the same token are skipped by processUpdate. Updates are marked as handled
+        when they are received, so one interrupted by a crash is not handled again.
+        On failure, methods return None and lastError() tells why; with 'raise_errors'
+        True the error (see errors.py) is raised instead.
+        Jobs created with schedule are kept in the sqlite database 'jobs_file', if given;
+        jobs already stored there start running here.
+        Every request goes through 'transport' (see transport.py), by default a
+        RequestsTransport; an HTTPXTransport multiplexes concurrent calls over HTTP/2.
         """
 
         #token provided by Botfather for your bot
         self.token = token
         #base URL for API access
-        self.apiURL = "https://api.telegram.org/bot" + self.token + "/"
+        self.apiURL = API_URL + self.token + "/"
+        #array with messages sent for this bot
+        self.messages = []
+        #general purpose dictionary
+        self.vars = {}
+        #(ID + 1) of last received message from server. to avoid duplicates.
+        self.offset = offset
+        #pollers advance the offset from several threads (see advanceOffset)
+        self._offset_lock = threading.Lock()
+        #set True for auto send chat status while uploading objects
+        self.auto_status = auto_status
+        #set True to raise TelegramError exceptions instead of returning None
+        self.raise_errors = raise_errors
+        #last TelegramError of each thread
+        self._errors = threading.local()
+        #chats that blocked the bot, and chats under flood control (chat id -> retry time)
+        self._blocked_chats = TTLCache(BLOCKED_CHAT_TTL, max_entries=100000)
+        self._flood_control = TTLCache(60, max_entries=100000)
+        #File objects returned by getFile, keyed by file_id
+        self._file_cache = TTLCache(FILE_LINK_TTL)
+        #pages of profile photos of each user: user id -> {(offset, limit): UserProfilePhotos}
+        self._profile_cache = TTLCache(PROFILE_PHOTOS_TTL, max_entries=10000)
+        #local copies of downloaded files
+        self._media_cache = media_cache
+        #downloads in progress, so the same file is not fetched twice at once
+        self._downloads = SingleFlight()
+        #getFile requests in progress
+        self._file_requests = SingleFlight()
+        #background sender for chat actions
+        self._chat_actions = ChatActionManager(self)
+        #background pools for uploads and for lightweight calls, created on first use
+        self._pool_settings = (upload_workers, upload_bandwidth, send_workers)
+        self._upload_pool = None
+        self._send_pool = None
+        #threads of getUserProfilePhotosBulk, kept between calls
+        self._profile_pool = None
+        self._profile_workers = 0
+        self._pool_lock = threading.Lock()
+
+        #HTTP transport used for every API call (replaced by a fake one when replaying traffic)
+        if transport is None:
+            transport = RequestsTransport()
+        self._transport = transport
+        #replay.Recorder saving incoming updates, if recording
+        self._recorder = None
+        #store of handled update ids, shared between bot objects with the same token
+        self._dedup = dedup
+        self._dedup_key = _tokenKey(token)[:16]
+        #middleware.MiddlewarePipeline between updates and handlers, created by use()
+        self._middleware = None
+        #scheduler.JobScheduler running delayed and recurring calls, created on first use
+        self._jobs_file = jobs_file
+        self._scheduler = None
+        if jobs_file != None and os.path.exists(jobs_file):
+            self._jobScheduler()
+
         #information about this bot
-        self.me = None
-        if self.getMe() is None:
-            logging.warning("Bot.__init__(): Failed to start a bot. Aborting.")
-            #check if the boy was successfully started
-            self.success = False
+        self._me = None
+        self._lazy = lazy
+        self._identity_file = identity_file
+        self._identity_lock = threading.Lock()
+        #monotonic time before which a failed lazy getMe is not retried
+        self._identity_retry = 0.0
+        if identity_file != None:
+            self._me = loadIdentity(identity_file, token)
+
+        if self._me is not None:
+            logging.info("Bot.__init__(): Bot %s loaded from %s.", self._me.first_name, identity_file)
+            if validate:
+                threading.Thread(target=self._validateIdentity, name="BotValidate", daemon=True).start()
+        elif not lazy:
+            if self.getMe() is None:
+                logging.warning("Bot.__init__(): Failed to start a bot. Aborting.")
+            else:
+                logging.info("Bot.__init__(): Bot %s started.", self._me.first_name)
+
+    @property
+    def me(self):
+        """
+        User object for this bot. For lazy bots, getMe is called on first access.
+        """
+        if self._me is None and self._lazy and time.monotonic() >= self._identity_retry:
+            with self._identity_lock:
+                if self._me is None and time.monotonic() >= self._identity_retry:
+                    #a failure is kept for IDENTITY_RETRY_DELAY, so every read does not block on a request
+                    self._identity_retry = time.monotonic() + IDENTITY_RETRY_DELAY
+                    if self.getMe() is not None:
+                        self._identity_retry = 0.0
+        return self._me
+
+    @me.setter
+    def me(self, user):
+        self._me = user
+
+    @property
+    def success(self):
+        """
+        True if the bot information could be retrieved (check if the boy was successfully started).
+        """
+        return self.me is not None
+
+    def _request(self, method, parameters=None, files=None, post=False, timeout=GLOBAL_TIMEOUT):
+        """
+        (str, dict, dict, bool, float) -> None/any
+        Call an API method and return the "result" of the answer. On failure the
+        TelegramError is logged and kept for lastError(), then raised if 'raise_errors'
+        is set, otherwise None is returned.
+        Requests to a chat that blocked the bot, or that is under flood control, fail
+        right away without a network call.
+        """
+        chat_id = None
+        if parameters is not None:
+            chat_id = parameters.get("chat_id")
+        if chat_id is not None:
+            if self._blocked_chats.get(chat_id) is not None:
+                return self._fail(method, ChatBlocked("Chat %s blocked the bot" %chat_id, 403, method=method))
+            retryTime = self._flood_control.get(chat_id)
+            if retryTime is not None:
+                retry_after = max(1, int(retryTime - time.time() + 0.5))
+                return self._fail(method, RetryAfter("Flood control, retry in %d seconds" %retry_after, 429,
+                                                     {"retry_after":retry_after}, method))
+
+        try:
+            ans = self._transport.call(self.apiURL + method, parameters, files, post, timeout)
+        except TransportError as error:
+            return self._fail(method, NetworkError(str(error), method=method))
+
+        if ans["ok"]:
+            self._errors.last = None
+            return ans["result"]
+
+        error = errorFromResponse(ans, method)
+        if chat_id is not None:
+            if isinstance(error, Forbidden):
+                self._blocked_chats.put(chat_id, True)
+            elif isinstance(error, RetryAfter) and error.retry_after:
+                self._flood_control.put(chat_id, time.time() + error.retry_after, ttl=error.retry_after)
+        return self._fail(method, error)
+
+    def _fail(self, method, error):
+        """
+        (str, TelegramError) -> None
+        Record a failure of 'method'. Raises 'error' if 'raise_errors' is set.
+        """
+        self._errors.last = error
+        logging.warning("Bot.%s(): Failed. Aborting." %method)
+        logging.info("          Server's answer:\n          %s" %error)
+        if self.raise_errors:
+            raise error
+        return None
+
+    def lastError(self):
+        """
+        () -> None/TelegramError
+        Why the last call of this thread failed, or None if it succeeded.
+        Check 'retryable' to know if retrying later may work.
+        """
+        return getattr(self._errors, "last", None)
+
+    def isBlocked(self, to):
+        """
+        (User/Chat) -> bool
+        True if this chat blocked the bot (or kicked it) recently. Requests to it fail
+        with ChatBlocked without contacting the server.
+        """
+        return self._blocked_chats.get(to.id) is not None
+
+    def forgetBlocked(self, to=None):
+        """
+        (User/Chat) -> None
+        Allow requests to a chat marked as blocked again (every chat if 'to' is None).
+        """
+        if to is None:
+            self._blocked_chats.invalidate()
         else:
-            logging.info("Bot.__init__(): Bot %s started.", self.me.first_name)
-            self.success = True
-            #array with messages sent for this bot
-            self.messages = []
-            #general purpose dictionary
-            self.vars = {}
-            #(ID + 1) of last received message from server. to avoid duplicates.
-            self.offset = offset
-            #set True for auto send chat status while uploading objects
-            self.auto_status = auto_status
+            self._blocked_chats.invalidate(to.id)
 
     def getMe(self):
         """
@@ -63,54 +263,158 @@ class Bot:
         Get bot information from server
         https://core.telegram.org/bots/api#getme
         """
-        try:
-            logging.info("Bot.getMe(): Requesting information.")
-            myData = requests.get(self.apiURL + "getMe", timeout=GLOBAL_TIMEOUT).json()
-        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError,
-                requests.exceptions.TooManyRedirects):
+        logging.info("Bot.getMe(): Requesting information.")
+        myData = self._request("getMe")
+        if myData is None:
             return None
 
-        if not myData["ok"]:
-            logging.warning("Bot.getMe(): Error while trying to get bot information. Aborting.")
-            logging.info("          Server's answer:\n          Error %d: %s" %( myData["error_code"], myData["description"] ))
-            return None
-        else:
-            myData = myData["result"]
-
         self.me = User(myData)
+        if self._identity_file != None:
+            saveIdentity(self._identity_file, self.token, self.me)
         return True
 
-    def getUpdates(self):
+    def _validateIdentity(self):
         """
-        () -> None/True
+        () -> None
+        Check the identity loaded from the identity file with getMe (background thread).
+        If the token was revoked, the stale identity is dropped from memory and from the file.
+        """
+        try:
+            if self.getMe() is not None:
+                return
+            error = self.lastError()
+        except TelegramError as raised:
+            error = raised
+        logging.warning("Bot._validateIdentity(): Validation failed: %s" %error)
+        if isinstance(error, Unauthorized):
+            self._me = None
+            if self._identity_file != None:
+                forgetIdentity(self._identity_file, self.token)
+
+    def getUpdates(self, timeout=0):
+        """
+        (int) -> None/True
         Get messages from server using the getUpdates API method.
+        'timeout' > 0 enables long polling: the server holds the request up to 'timeout'
+        seconds until an update arrives.
         https://core.telegram.org/bots/api#getupdates
         """
-        parameters = {"offset":self.offset}
-
-        try:
-            logging.info("Bot.getUpdates(): Requesting updates.")
-            updatesJSON = requests.get(self.apiURL + "getUpdates", params=parameters, timeout=GLOBAL_TIMEOUT).json()
-        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError,
-                requests.exceptions.TooManyRedirects):
-            logging.warning("Bot.getUpdates(): requests raises an exception. Aborting.")
+        if self.pollUpdates(timeout) is None:
             return None
+        logging.info("Bot.getUpdates(): Success.")
+        return True
 
-        if not updatesJSON["ok"]:
-            logging.warning("Bot.getUpdates(): Server returned an error.")
-            logging.info("          Server's answer:\n          Error %d: %s" %( updatesJSON["error_code"], updatesJSON["description"] ))
+    def pollUpdates(self, timeout=0):
+        """
+        (int) -> None/[Message]
+        Like getUpdates, but return the new messages (also appended to 'messages').
+        """
+        updatesJSON = self.fetchUpdates(timeout)
+        if updatesJSON is None:
             return None
-        updatesJSON = updatesJSON["result"]
         logging.info("Bot.getUpdates(): There is %d new messages in this update" %len(updatesJSON))
+        newMessages = []
         for update in updatesJSON:
-            if "message" in update:
-                update = Update(update)
-                self.messages.append(update.message)
-                if update.update_id >= self.offset -1:
-                    self.offset = update.update_id + 1
-        logging.info("Bot.getUpdates(): Success.")
-        return True
+            message = self.processUpdate(update)
+            if message is not None:
+                newMessages.append(message)
+        return newMessages
+
+    def fetchUpdates(self, timeout=0):
+        """
+        (int) -> None/[dict]
+        Request updates after 'offset' and return them unparsed.
+        """
+        parameters = {"offset":self.offset}
+        if timeout:
+            parameters["timeout"] = timeout
+
+        logging.info("Bot.getUpdates(): Requesting updates.")
+        return self._request("getUpdates", parameters, timeout=GLOBAL_TIMEOUT + timeout)
 
+    def advanceOffset(self, update_id):
+        """
+        (int) -> None
+        Move 'offset' past 'update_id'. The offset only grows, atomically, so a thread
+        handling an old update never moves it back behind a batch already fetched.
+        """
+        with self._offset_lock:
+            if update_id >= self.offset:
+                self.offset = update_id + 1
+
+    def processUpdate(self, updateData, store=True):
+        """
+        (dict, bool) -> None/Message
+        Handle one update, as returned by getUpdates or posted to a webhook: advance 'offset',
+        parse it and append its message to 'messages' (unless 'store' is False). Returns the
+        message, or None for updates without a message and for duplicates (with a dedup store).
+        """
+        if self._recorder is not None:
+            self._recorder.write(updateData)
+        self.advanceOffset(updateData["update_id"])
+        if self._dedup is not None and not self._dedup.checkAndMark(self._dedup_key, updateData["update_id"]):
+            logging.info("Bot.processUpdate(): Skipping duplicate update %d." %updateData["update_id"])
+            return None
+        #middlewares may drop the update before it is parsed
+        if self._middleware is not None and not self._middleware.filterUpdate(self, updateData):
+            return None
+        if "message" not in updateData:
+            return None
+        update = Update(updateData)
+        #whoever writes to the bot does not block it anymore
+        self._blocked_chats.invalidate(update.message.chat.id)
+        if store:
+            self.messages.append(update.message)
+        return update.message
+
+    def use(self, middleware):
+        """
+        (middleware.Middleware) -> None
+        Append 'middleware' to the chain run by processUpdate (onUpdate hooks) and
+        dispatch (before/after hooks), in the order of the calls to use.
+        """
+        if self._middleware is None:
+            from .middleware import MiddlewarePipeline
+            self._middleware = MiddlewarePipeline()
+        self._middleware.add(middleware)
+
+    def dispatch(self, handler, message):
+        """
+        (callable, Message) -> any
+        Call handler(bot, message) through the middlewares. Returns the handler result.
+        """
+        if self._middleware is None:
+            return handler(self, message)
+        return self._middleware.dispatch(self, message, handler)
+
+    def middlewareStats(self):
+        """
+        () -> dict
+        Time spent in each middleware hook and in the handlers (see MiddlewarePipeline.stats).
+        """
+        if self._middleware is None:
+            return {}
+        return self._middleware.stats()
+
+    def record(self, filepath):
+        """
+        (str) -> None
+        Append every update handled by processUpdate to 'filepath' (see replay.Recorder),
+        so the traffic can be replayed offline later.
+        """
+        from .replay import Recorder
+        self.stopRecording()
+        logging.info("Bot.record(): Recording updates to %s" %filepath)
+        self._recorder = Recorder(filepath)
+
+    def stopRecording(self):
+        """
+        () -> None
+        Stop recording updates.
+        """
+        if self._recorder is not None:
+            self._recorder.close()
+            self._recorder = None
 
     def sendMessage(self, to, text, disable_web_page_preview=False, replyTo=None, reply_markup=None):
         """
@@ -121,25 +425,78 @@ class Bot:
 
         parameters = {"chat_id":to.id, "text":text, "disable_web_page_preview":disable_web_page_preview}
         if replyTo != None:
-            parameters["reply_to_message_id"] = replyTo.id
+            parameters["reply_to_message_id"] = replyTo.message_id
         if reply_markup != None:
             parameters["reply_markup"] = reply_markup.toJSON()
 
-        try:
-            logging.info("Bot.sendMessage(): Sending a message.")
-            messagePingback = requests.get(self.apiURL + "sendMessage", params=parameters, timeout=GLOBAL_TIMEOUT).json()
-        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError,
-                requests.exceptions.TooManyRedirects):
-            logging.warning("Bot.sendMessage(): requests raises an exception. Aborting.")
+        logging.info("Bot.sendMessage(): Sending a message.")
+        messagePingback = self._request("sendMessage", parameters)
+        if messagePingback is None:
             return None
 
-        if not messagePingback["ok"]:
-            logging.warning("Bot.sendMessage(): Failed to send.")
-            logging.info("          Server's answer:\n          Error %d: %s" %( messagePingback["error_code"], messagePingback["description"] ))
+        logging.info("Bot.sendMessage(): Success.")
+        return Message( messagePingback )
+
+    def editMessageText(self, message, text, disable_web_page_preview=False, reply_markup=None):
+        """
+        (Message, string, bool, ReplyKeyboardMarkup/...) -> None/Message
+        Replace the text of a message sent by the bot. Return the edited message on success.
+        https://core.telegram.org/bots/api#editmessagetext
+        """
+        parameters = {"chat_id":message.chat.id, "message_id":message.message_id,
+                      "text":text, "disable_web_page_preview":disable_web_page_preview}
+        if reply_markup != None:
+            parameters["reply_markup"] = reply_markup.toJSON()
+
+        logging.info("Bot.editMessageText(): Editing message %d." %message.message_id)
+        ans = self._request("editMessageText", parameters)
+        if ans is None:
             return None
+        logging.info("Bot.editMessageText(): Success.")
+        return Message( ans )
 
-        logging.info("Bot.sendMessage(): Success.")
-        return Message( messagePingback["result"] )
+    def editMessageReplyMarkup(self, message, reply_markup=None):
+        """
+        (Message, ReplyKeyboardMarkup/...) -> None/Message
+        Replace (or remove, if None) the reply markup of a message sent by the bot.
+        Return the edited message on success.
+        https://core.telegram.org/bots/api#editmessagereplymarkup
+        """
+        parameters = {"chat_id":message.chat.id, "message_id":message.message_id}
+        if reply_markup != None:
+            parameters["reply_markup"] = reply_markup.toJSON()
+
+        logging.info("Bot.editMessageReplyMarkup(): Editing message %d." %message.message_id)
+        ans = self._request("editMessageReplyMarkup", parameters)
+        if ans is None:
+            return None
+        logging.info("Bot.editMessageReplyMarkup(): Success.")
+        return Message( ans )
+
+    def deleteMessage(self, message):
+        """
+        (Message) -> None/True
+        Delete a message.
+        https://core.telegram.org/bots/api#deletemessage
+        """
+        parameters = {"chat_id":message.chat.id, "message_id":message.message_id}
+
+        logging.info("Bot.deleteMessage(): Deleting message %d." %message.message_id)
+        ans = self._request("deleteMessage", parameters)
+        if ans is None:
+            return None
+        logging.info("Bot.deleteMessage(): Success.")
+        return True
+
+    def streamReply(self, to, replyTo=None, min_interval=1.0):
+        """
+        (User/Chat, Message, float) -> StreamingReply
+        Start a reply that is written incrementally: the first chunk is sent right away,
+        later chunks are merged into edits of the same message, at most one every
+        'min_interval' seconds. See streaming.StreamingReply.
+        """
+        from .streaming import StreamingReply
+        return StreamingReply(self, to, replyTo=replyTo, min_interval=min_interval)
 
     def forwardMessage(self, to, message):
         """
@@ -150,20 +507,12 @@ class Bot:
 
         parameters = {"chat_id":to.id, "from_chat_id":message.chat.id, "message_id":message.message_id}
 
-        try:
-            logging.info("Bot.forwardMessage(): Forwarding a message.")
-            ans = requests.get(self.apiURL + "forwardMessage", params = parameters, timeout=GLOBAL_TIMEOUT).json()
-        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError,
-                requests.exceptions.TooManyRedirects):
-            logging.warning("Bot.forwardMessage(): requests raises an exception. Aborting.")
-            return None
-
-        if not ans["ok"]:
-            logging.warning("Bot.forwardMessage(): Failed to send.")
-            logging.info("          Server's answer:\n          Error %d: %s" %( ans["error_code"], ans["description"] ))
+        logging.info("Bot.forwardMessage(): Forwarding a message.")
+        ans = self._request("forwardMessage", parameters)
+        if ans is None:
             return None
         logging.info("Bot.forwardMessage(): Success.")
-        return Message( ans["result"] )
+        return Message( ans )
 
 
     def sendObject(self, to, inputObj=None, obj=None, objType=None, caption=None, replyTo=None, reply_markup=None):
@@ -184,42 +533,26 @@ class Bot:
             return None
 
         elif obj == None and objType != None:
-            files = {objType:inputObj.file}
+            files = {objType:inputObj.toUpload()}
             if files[objType] is None:
-                logging.warning("Bot.sendObject(): Bad file to upload. Aborting.")
+                logging.warning("Bot.sendObject(): Bad file to upload (%s). Aborting." %inputObj.error)
                 return None
 
-            try:
-                logging.info("Bot.sendObject(): Uploading file of type %s" %objType)
-                ans = requests.post(self.apiURL + "send" + objType.title(), files = files,
-                                    params = parameters, timeout=GLOBAL_TIMEOUT).json()
-            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError,
-                requests.exceptions.TooManyRedirects):
-                logging.warning("Bot.sendObject(): requests raises an exception. Aborting.")
-                return None
-
-
+            logging.info("Bot.sendObject(): Uploading file of type %s" %objType)
+            ans = self._request("send" + objType.title(), parameters, files=files, post=True)
 
         elif inputObj == None and objType != None:
             parameters[objType] = obj.file_id
-            try:
-                logging.info("Bot.sendObject(): Resending file of type %s" %objType)
-                ans = requests.post(self.apiURL + "send" + objType.title(),
-                                    params = parameters, timeout=GLOBAL_TIMEOUT).json()
-            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError,
-                requests.exceptions.TooManyRedirects):
-                logging.warning("Bot.sendObject(): requests raises an exception. Aborting.")
-                return None
+            logging.info("Bot.sendObject(): Resending file of type %s" %objType)
+            ans = self._request("send" + objType.title(), parameters, post=True)
 
         else:
             logging.warning("Bot.sendObject(): Bad request. Aborting")
             return None
 
-        if not ans["ok"]:
-            logging.warning("Bot.sendObject(): Failed to send.")
-            logging.info("          Server's answer:\n          Error %d: %s" %( ans["error_code"], ans["description"] ))
+        if ans is None:
             return None
-        ans = Message( ans["result"] )
+        ans = Message( ans )
         return ans
 
     def sendPhoto(self, to, inputObj=None, obj=None, caption=None, replyTo=None, reply_markup=None):
@@ -230,9 +563,8 @@ class Bot:
         Return the sent message on success.
         https://core.telegram.org/bots/api#sendphoto
         """
-        if self.auto_status:
-            self.sendChatAction(to, "upload_photo")
-        return self.sendObject(to, inputObj=inputObj, obj=obj, objType="photo", caption=caption, replyTo=replyTo, reply_markup=reply_markup)
+        with self._autoStatus(to, "upload_photo"):
+            return self.sendObject(to, inputObj=inputObj, obj=obj, objType="photo", caption=caption, replyTo=replyTo, reply_markup=reply_markup)
 
     def sendAudio(self, to, inputObj=None, obj=None, replyTo=None, reply_markup=None):
         """
@@ -243,9 +575,8 @@ class Bot:
         Return the sent message on success.
         https://core.telegram.org/bots/api#sendaudio
         """
-        if self.auto_status:
-            self.sendChatAction(to, "upload_audio")
-        return self.sendObject(to, inputObj=inputObj, obj=obj, objType="audio", replyTo=replyTo, reply_markup=reply_markup)
+        with self._autoStatus(to, "upload_audio"):
+            return self.sendObject(to, inputObj=inputObj, obj=obj, objType="audio", replyTo=replyTo, reply_markup=reply_markup)
 
 
     def sendVoice(self, to, inputObj=None, obj=None, replyTo=None, reply_markup=None):
@@ -257,9 +588,8 @@ class Bot:
         Return the sent message on success.
         https://core.telegram.org/bots/api#sendaudio
         """
-        if self.auto_status:
-            self.sendChatAction(to, "upload_audio")
-        return self.sendObject(to, inputObj=inputObj, obj=obj, objType="voice", replyTo=replyTo, reply_markup=reply_markup)
+        with self._autoStatus(to, "upload_audio"):
+            return self.sendObject(to, inputObj=inputObj, obj=obj, objType="voice", replyTo=replyTo, reply_markup=reply_markup)
 
     def sendDocument(self, to, inputObj=None, obj=None, replyTo=None, reply_markup=None):
         """
@@ -270,9 +600,8 @@ class Bot:
         Return the sent message on success.
         https://core.telegram.org/bots/api#senddocument
         """
-        if self.auto_status:
-            self.sendChatAction(to, "upload_document")
-        return self.sendObject(to, inputObj=inputObj, obj=obj, objType="document", replyTo=replyTo, reply_markup=reply_markup)
+        with self._autoStatus(to, "upload_document"):
+            return self.sendObject(to, inputObj=inputObj, obj=obj, objType="document", replyTo=replyTo, reply_markup=reply_markup)
 
     def sendSticker(self, to, inputObj=None, obj=None, replyTo=None, reply_markup=None):
         """
@@ -294,9 +623,176 @@ class Bot:
         Return the sent message on success.
         https://core.telegram.org/bots/api#sendvideo
         """
-        if self.auto_status:
-            self.sendChatAction(to, "upload_video")
-        return self.sendObject(to, inputObj=inputObj, obj=obj, objType="video", replyTo=replyTo, reply_markup=reply_markup)
+        with self._autoStatus(to, "upload_video"):
+            return self.sendObject(to, inputObj=inputObj, obj=obj, objType="video", replyTo=replyTo, reply_markup=reply_markup)
+
+    def sendMediaGroup(self, to, media, replyTo=None):
+        """
+        (User/Chat, [InputMedia], Message) -> None/[Message]
+        Send 2 to 10 photos or videos as an album. New uploads (InputFile) and already
+        uploaded files can be mixed; all new files go in one multipart request.
+        Return the sent messages on success.
+        https://core.telegram.org/bots/api#sendmediagroup
+        """
+        if len(media) < 2 or len(media) > 10:
+            logging.warning("Bot.sendMediaGroup(): An album must have 2 to 10 items. Aborting.")
+            return None
+
+        parameters = {"chat_id":to.id}
+        if replyTo != None:
+            parameters["reply_to_message_id"] = replyTo.message_id
+
+        files = {}
+        mediaArray = []
+        for index, item in enumerate(media):
+            if item.isUpload():
+                attachName = "file%d" %index
+                files[attachName] = item.media.toUpload()
+                if files[attachName] is None:
+                    logging.warning("Bot.sendMediaGroup(): Bad file to upload at position %d (%s). Aborting." %(index, item.media.error))
+                    return None
+                mediaArray.append( item.toDict("attach://" + attachName) )
+            else:
+                mediaArray.append( item.toDict() )
+        parameters["media"] = json.dumps(mediaArray)
+
+        if any(item.type == "video" for item in media):
+            action = "upload_video"
+        else:
+            action = "upload_photo"
+
+        logging.info("Bot.sendMediaGroup(): Sending an album with %d items (%d new uploads)" %(len(media), len(files)))
+        with self._autoStatus(to, action):
+            ans = self._request("sendMediaGroup", parameters, files=files or None, post=True)
+        if ans is None:
+            return None
+        logging.info("Bot.sendMediaGroup(): Success.")
+        return [Message(messageData) for messageData in ans]
+
+    def _pools(self):
+        """
+        () -> (UploadPool, ThreadPoolExecutor)
+        Background pools, created on first use.
+        """
+        with self._pool_lock:
+            if self._send_pool is None:
+                from .uploads import UploadPool
+                from concurrent.futures import ThreadPoolExecutor
+                upload_workers, upload_bandwidth, send_workers = self._pool_settings
+                self._upload_pool = UploadPool(upload_workers, upload_bandwidth)
+                self._send_pool = ThreadPoolExecutor(max_workers=send_workers, thread_name_prefix="BotSend")
+            return self._upload_pool, self._send_pool
+
+    def submit(self, method, *args, **kwargs):
+        """
+        (str/method, ...) -> Future
+        Call a Bot method in the background and return a concurrent.futures.Future
+        with its result. Calls that upload files (InputFile/InputMedia arguments) run on
+        the upload pool, with its own concurrency and bandwidth limits; any other call runs
+        on the send pool, so large uploads never delay interactive replies.
+        """
+        from .uploads import uploadSize
+        if isinstance(method, str):
+            method = getattr(self, method)
+        uploadPool, sendPool = self._pools()
+        nbytes = uploadSize(args, kwargs)
+        if nbytes is None:
+            return sendPool.submit(method, *args, **kwargs)
+        logging.info("Bot.submit(): Queueing upload of %d bytes." %nbytes)
+        return uploadPool.submit(nbytes, method, *args, **kwargs)
+
+    def sendPhoto_async(self, to, inputObj=None, obj=None, caption=None, replyTo=None, reply_markup=None):
+        """
+        (User/Chat, InputFile, PhotoSize, string, Message, not supported yet) -> Future
+        Non-blocking sendPhoto. The Future's result is the sent message (or None).
+        """
+        return self.submit(self.sendPhoto, to, inputObj=inputObj, obj=obj, caption=caption, replyTo=replyTo, reply_markup=reply_markup)
+
+    def sendAudio_async(self, to, inputObj=None, obj=None, replyTo=None, reply_markup=None):
+        """
+        (User/Chat, InputFile, Audio, Message, not supported yet) -> Future
+        Non-blocking sendAudio. The Future's result is the sent message (or None).
+        """
+        return self.submit(self.sendAudio, to, inputObj=inputObj, obj=obj, replyTo=replyTo, reply_markup=reply_markup)
+
+    def sendVoice_async(self, to, inputObj=None, obj=None, replyTo=None, reply_markup=None):
+        """
+        (User/Chat, InputFile, Voice, Message, not supported yet) -> Future
+        Non-blocking sendVoice. The Future's result is the sent message (or None).
+        """
+        return self.submit(self.sendVoice, to, inputObj=inputObj, obj=obj, replyTo=replyTo, reply_markup=reply_markup)
+
+    def sendDocument_async(self, to, inputObj=None, obj=None, replyTo=None, reply_markup=None):
+        """
+        (User/Chat, InputFile, Document, Message, not supported yet) -> Future
+        Non-blocking sendDocument. The Future's result is the sent message (or None).
+        """
+        return self.submit(self.sendDocument, to, inputObj=inputObj, obj=obj, replyTo=replyTo, reply_markup=reply_markup)
+
+    def sendSticker_async(self, to, inputObj=None, obj=None, replyTo=None, reply_markup=None):
+        """
+        (User/Chat, InputFile, Sticker, Message, not supported yet) -> Future
+        Non-blocking sendSticker. The Future's result is the sent message (or None).
+        """
+        return self.submit(self.sendSticker, to, inputObj=inputObj, obj=obj, replyTo=replyTo, reply_markup=reply_markup)
+
+    def sendVideo_async(self, to, inputObj=None, obj=None, replyTo=None, reply_markup=None):
+        """
+        (User/Chat, InputFile, Video, Message, not supported yet) -> Future
+        Non-blocking sendVideo. The Future's result is the sent message (or None).
+        """
+        return self.submit(self.sendVideo, to, inputObj=inputObj, obj=obj, replyTo=replyTo, reply_markup=reply_markup)
+
+    def sendMediaGroup_async(self, to, media, replyTo=None):
+        """
+        (User/Chat, [InputMedia], Message) -> Future
+        Non-blocking sendMediaGroup. The whole album is one job of the upload pool, charged
+        with the total size of its new files. The Future's result is the sent messages (or None).
+        """
+        return self.submit(self.sendMediaGroup, to, media, replyTo=replyTo)
+
+    def schedule(self, when, method, to, *args, every=None, cron=None, **kwargs):
+        """
+        (float/datetime, str, User/Chat, ..., float, str, ...) -> str
+        Call self.<method>(to, *args, **kwargs) at 'when' (a datetime or a delay in seconds),
+        then every 'every' seconds or at the times matching 'cron' ("minute hour day month
+        weekday"), if given. Due calls run on the send pool. Returns the job id.
+        https://en.wikipedia.org/wiki/Cron
+        """
+        return self._jobScheduler().schedule(when, method, to, *args, every=every, cron=cron, **kwargs)
+
+    def cancelJob(self, jobId):
+        """
+        (str) -> bool
+        Cancel a job created with schedule. Returns False if it does not exist (anymore).
+        """
+        return self._jobScheduler().cancel(jobId)
+
+    def _jobScheduler(self):
+        with self._pool_lock:
+            if self._scheduler is None:
+                from .scheduler import JobScheduler
+                self._scheduler = JobScheduler(self, self._jobs_file)
+                self._scheduler.start()
+            return self._scheduler
+
+    def shutdown(self, wait=True):
+        """
+        (bool) -> None
+        Stop the job scheduler and the background pools and close the connections of the
+        transport. If 'wait' is True, block until queued calls finish.
+        """
+        logging.info("Bot.shutdown(): Stopping background pools.")
+        if self._scheduler is not None:
+            self._scheduler.stop()
+        with self._pool_lock:
+            if self._send_pool is not None:
+                self._upload_pool.shutdown(wait=wait)
+                self._send_pool.shutdown(wait=wait)
+            if self._profile_pool is not None:
+                self._profile_pool.shutdown(wait=wait)
+                self._profile_pool = None
+        self._transport.close()
 
     def sendLocation(self, to, obj, replyTo=None, reply_markup=None):
         """
@@ -305,9 +801,6 @@ class Bot:
         Return the sent message on success.
         https://core.telegram.org/bots/api#sendlocation
         """
-        if self.auto_status:
-            self.sendChatAction(to, "find_location")
-
         parameters = {"chat_id":to.id, "latitude":obj.latitude,
                       "longitude":obj.longitude, "objType":"location"}
         if replyTo != None:
@@ -315,14 +808,11 @@ class Bot:
         if reply_markup != None:
             parameters["reply_markup"] = reply_markup.toJSON()
 
-        try:
-            ans = requests.get(self.apiURL + "sendLocation", params = parameters, timeout=GLOBAL_TIMEOUT).json()
-        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError,
-                requests.exceptions.TooManyRedirects):
-                return None
-        if not ans["ok"]:
+        with self._autoStatus(to, "find_location"):
+            ans = self._request("sendLocation", parameters)
+        if ans is None:
             return None
-        ans = Message( ans["result"] )
+        ans = Message( ans )
         return ans
 
 
@@ -337,54 +827,264 @@ class Bot:
                           "record_audio", "upload_audio", "upload_document", "find_location"]:
             return None
         parameters = {"chat_id":to.id, "action":action}
-        try:
-            ans = requests.get(self.apiURL + "sendChatAction", params = parameters, timeout=GLOBAL_TIMEOUT).json()
-        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError,
-                requests.exceptions.TooManyRedirects):
-                return None
-        if not ans["ok"]:
+        if self._request("sendChatAction", parameters) is None:
             return None
         else:
             return True
 
-    def getFile(self, file_obj):
+    def queueChatAction(self, to, action):
+        """
+        (User/Chat, string) -> bool
+        Like sendChatAction, but returns immediately: the action is sent from a background
+        thread, and skipped if the same action is still visible in this chat (about 5s).
+        Returns False if the action was skipped.
+        """
+        return self._chat_actions.send(to, action)
+
+    def _autoStatus(self, to, action):
+        """
+        (User/Chat, string) -> context manager
+        Keep 'action' visible while the 'with' block runs if auto_status is set.
+        """
+        if self.auto_status:
+            return self._chat_actions.keep(to, action)
+        return nullcontext()
+
+    def getUserProfilePhotos(self, user, offset=0, limit=100, use_cache=True):
+        """
+        (User, int, int, bool) -> None/UserProfilePhotos
+        Request one page of the profile pictures of 'user': at most 'limit' (1-100) photos,
+        starting at 'offset'. Pages are cached per user for PROFILE_PHOTOS_TTL seconds;
+        set 'use_cache' False to force the request.
+        https://core.telegram.org/bots/api#getuserprofilephotos
+        """
+        pages = self._profile_cache.get(user.id)
+        if use_cache and pages is not None and (offset, limit) in pages:
+            logging.info("Bot.getUserProfilePhotos(): Using cached photos of %s." %user.id)
+            return pages[(offset, limit)]
+
+        parameters = {"user_id":user.id, "offset":offset, "limit":limit}
+        ans = self._request("getUserProfilePhotos", parameters)
+        if ans is None:
+            return None
+        photos = UserProfilePhotos(ans)
+        if pages is None:
+            pages = {}
+            self._profile_cache.put(user.id, pages)
+        pages[(offset, limit)] = photos
+        return photos
+
+    def iterUserProfilePhotos(self, user, page_size=100):
+        """
+        (User, int) -> generator of [PhotoSize]
+        Iterate over all the profile pictures of 'user' (each one as its array of sizes),
+        requesting the pages of 'page_size' photos one at a time, only when needed.
+        Stops early if a request fails (see lastError).
+        """
+        offset = 0
+        while True:
+            page = self.getUserProfilePhotos(user, offset, page_size)
+            if page is None or not page.photos:
+                return
+            for photo in page.photos:
+                yield photo
+            offset += len(page.photos)
+            if offset >= page.total_count:
+                return
+
+    def getUserProfilePhotosBulk(self, users, limit=1, workers=8, rate=PROFILE_PHOTOS_RATE):
+        """
+        ([User], int, int, float) -> dict
+        Request the first 'limit' profile pictures of many users at once, from 'workers'
+        threads and at most 'rate' requests per second (cached users cost nothing).
+        Returns {user id: UserProfilePhotos}, with None for failed requests.
         """
-        (Video/Document/Audio/PhotoSize/Voice) -> File
+        from .uploads import BandwidthLimiter
+        #token bucket counting requests instead of bytes
+        limiter = BandwidthLimiter(rate)
+
+        def fetch(user):
+            pages = self._profile_cache.get(user.id)
+            if pages is None or (0, limit) not in pages:
+                limiter.acquire(1)
+            try:
+                return self.getUserProfilePhotos(user, 0, limit)
+            except TelegramError:
+                return None
+
+        users = list({user.id:user for user in users}.values())
+        logging.info("Bot.getUserProfilePhotosBulk(): Requesting photos of %d users." %len(users))
+        return dict(zip([user.id for user in users], self._profilePool(workers).map(fetch, users)))
+
+    def _profilePool(self, workers):
+        """
+        (int) -> ThreadPoolExecutor
+        Pool of 'workers' threads for getUserProfilePhotosBulk, created on first use and
+        replaced only when the number of workers changes.
+        """
+        with self._pool_lock:
+            if self._profile_pool is None or self._profile_workers != workers:
+                from concurrent.futures import ThreadPoolExecutor
+                if self._profile_pool is not None:
+                    self._profile_pool.shutdown(wait=False)
+                self._profile_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ProfilePhotos")
+                self._profile_workers = workers
+            return self._profile_pool
+
+    def getFile(self, file_obj, use_cache=True):
+        """
+        (Video/Document/Audio/PhotoSize/Voice, bool) -> File
         Request a download link.
         Returns a File object.
+        Links are cached by file_id while they are valid (FILE_LINK_TTL), so repeated
+        requests for the same file skip the round trip. Set 'use_cache' False to force it.
         """
-        parameters = {"file_id":file_obj.file_id}
-        try:
-            ans = requests.get(self.apiURL + "getFile", params = parameters, timeout=GLOBAL_TIMEOUT).json()
-        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError,
-                requests.exceptions.TooManyRedirects):
-                return None
-        if not ans["ok"]:
-            return None
+        if use_cache:
+            cached = self._file_cache.get(file_obj.file_id)
+            if cached is not None:
+                logging.info("Bot.getFile(): Using cached link for %s." %file_obj.file_id)
+                return cached
+
+        #concurrent requests for the same file share one round trip
+        fileObj, error = self._file_requests.do(file_obj.file_id, self._requestFile, file_obj.file_id)
+        #the request may have been made by another thread: report its outcome on this one too
+        self._errors.last = error
+        return fileObj
+
+    def _requestFile(self, file_id):
+        #returns (File, None) or (None, error), so callers sharing the request get the error
+        parameters = {"file_id":file_id}
+        ans = self._request("getFile", parameters)
+        if ans is None:
+            return None, self.lastError()
         else:
-            return File ( ans["result"] )
+            fileObj = File ( ans )
+            if fileObj.file_path != None:
+                self._file_cache.put(file_id, fileObj)
+            return fileObj, None
 
     def downloadFile(self, file_obj, dest_path):
         """
-        (File) -> bool
+        (File/Video/Document/Audio/PhotoSize/Voice, str) -> None/True
+        Download a file to 'dest_path'. If 'file_obj' is not a File, getFile is called first.
+        With a media cache, repeated downloads of the same file are copied from the cache
+        and concurrent downloads of the same file share a single request.
         """
         logging.info("Bot.downloadFile(): Starting download request.")
-        if file_obj.file_path == None:
+        if not isinstance(file_obj, File):
+            file_obj = self.getFile(file_obj)
+        if file_obj is None or file_obj.file_path == None:
+            return None
+
+        if self._media_cache is not None:
+            #the cached copy may be evicted before it is copied: download it again once,
+            #then stream it directly to 'dest_path'
+            for attempt in range(2):
+                cachedPath = self._cachedDownload(file_obj)
+                if cachedPath is None:
+                    return None
+                try:
+                    shutil.copyfile(cachedPath, dest_path)
+                    return True
+                except FileNotFoundError:
+                    if os.path.exists(cachedPath):
+                        #it is 'dest_path' that cannot be created
+                        return None
+                    logging.info("Bot.downloadFile(): %s was evicted from the media cache." %cachedPath)
+                except IOError:
+                    return None
+
+        chunks = self._openDownload(file_obj)
+        if chunks is None:
             return None
-        try:
-            ans = requests.get("https://api.telegram.org/file/bot" + self.token + "/" + file_obj.file_path, stream=True, timeout=GLOBAL_TIMEOUT)
-        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError,
-                requests.exceptions.TooManyRedirects):
-                return None
         try:
             with open(dest_path, "wb") as f:
-                for chunk in ans.iter_content(chunk_size=1024):
+                for chunk in chunks:
                     if chunk:
                         f.write(chunk)
-        except IOError:
+        except (IOError, TransportError):
             return None
         return True
 
+    def downloadBuffer(self, file_obj):
+        """
+        (File/Video/Document/Audio/PhotoSize/Voice) -> None/mmap/bytes
+        Download a file to memory. With a media cache, returns a read only memory map
+        of the cached copy instead of reading it into memory.
+        """
+        logging.info("Bot.downloadBuffer(): Starting download request.")
+        if not isinstance(file_obj, File):
+            file_obj = self.getFile(file_obj)
+        if file_obj is None or file_obj.file_path == None:
+            return None
+
+        if self._media_cache is not None:
+            #the cached copy may be evicted before it is mapped: download it again once,
+            #then read it directly into memory
+            for attempt in range(2):
+                if self._cachedDownload(file_obj) is None:
+                    return None
+                mapped = self._media_cache.mapped(self._cacheKey(file_obj))
+                if mapped is not None:
+                    return mapped
+
+        chunks = self._openDownload(file_obj)
+        if chunks is None:
+            return None
+        try:
+            return b"".join(chunks)
+        except TransportError:
+            return None
+
+    def _cacheKey(self, file_obj):
+        if file_obj.file_unique_id != None:
+            return file_obj.file_unique_id
+        return file_obj.file_id
+
+    def _cachedDownload(self, file_obj):
+        """
+        (File) -> None/str
+        Path of the cached copy of 'file_obj', downloading it if needed.
+        """
+        key = self._cacheKey(file_obj)
+        cachedPath = self._media_cache.get(key)
+        if cachedPath is not None:
+            logging.info("Bot._cachedDownload(): Serving %s from media cache." %key)
+            return cachedPath
+        try:
+            return self._downloads.do(key, self._downloadToCache, file_obj, key)
+        except (IOError, TransportError):
+            logging.warning("Bot._cachedDownload(): Download of %s failed." %key)
+            return None
+
+    def _downloadToCache(self, file_obj, key):
+        #a previous download may have finished while we were waiting for the lock
+        cachedPath = self._media_cache.get(key)
+        if cachedPath is not None:
+            return cachedPath
+        chunks = self._openDownload(file_obj)
+        if chunks is None:
+            return None
+        return self._media_cache.store(key, chunks)
+
+    def _openDownload(self, file_obj):
+        """
+        (File) -> None/iterator
+        Start a streamed download and return an iterator over its chunks.
+        """
+        try:
+            status, chunks = self._transport.download(FILE_URL + self.token + "/" + file_obj.file_path,
+                                                      DOWNLOAD_CHUNK_SIZE, GLOBAL_TIMEOUT)
+        except TransportError as error:
+            return self._fail("downloadFile", NetworkError(str(error), method="downloadFile"))
+        if status >= 400:
+            if status == 404:
+                error = NotFound("File not found", status, method="downloadFile")
+            else:
+                error = TelegramError("HTTP error", status, method="downloadFile")
+            return self._fail("downloadFile", error)
+        return chunks
+
 
     def flushMessages(self):
         """
@@ -429,9 +1129,13 @@ class Bot:
         () -> str
         Formal representantion for Bot object (a valid dictionary representation)
         Useful for dump bot content to a persistent file
+        Internal runtime state (attributes starting with '_') is not included.
         """
         logging.info("Bot.__repr__(): Call for repr() to bot.")
-        return str(self.__dict__)
+        reprdict = {key:value for key, value in self.__dict__.items() if not key.startswith("_")}
+        reprdict["me"] = self._me
+        reprdict["success"] = self._me is not None
+        return str(reprdict)
 
     def __str__(self):
         """
@@ -448,6 +1152,92 @@ class Bot:
         if dumpFile is None:
             logging.info("Bot.dumpMeTo(): File error. Aborting.")
             return None
+        import ast
         json.dump( ast.literal_eval( repr(self) ), dumpFile, indent=3 )
         dumpFile.close()
         return True
+
+    def exportMessagesTo(self, filepath, format=None, batch_size=1000):
+        """
+        (str, str, int) -> None/int
+        Export 'messages' for analytics, one flat record per message, in Parquet (if pyarrow
+        is installed and 'filepath' ends with ".parquet") or NDJSON. See export.MessageExporter.
+        Returns the number of exported messages.
+        """
+        from .export import exportMessages
+        logging.info("Bot.exportMessagesTo(): Exporting %d messages to %s" %(len(self.messages), filepath))
+        try:
+            return exportMessages(self.messages, filepath, format=format, batch_size=batch_size)
+        except IOError:
+            logging.info("Bot.exportMessagesTo(): File error. Aborting.")
+            return None
+
+
+def loadIdentity(filepath, token):
+    """
+    (str, str) -> None/User
+    Read the bot information saved by saveIdentity for 'token'.
+    """
+    if not os.path.exists(filepath):
+        return None
+    identityFile = openFile(filepath, "r")
+    if identityFile is None:
+        return None
+    try:
+        with identityFile:
+            identities = json.load(identityFile)
+    except ValueError:
+        logging.warning("loadIdentity(): %s is not a valid identity file." %filepath)
+        return None
+    userData = identities.get(_tokenKey(token))
+    if userData is None:
+        return None
+    return User(userData)
+
+def saveIdentity(filepath, token, user):
+    """
+    (str, str, User) -> None/True
+    Save the bot information for 'token' in a JSON file shared by many tokens.
+    Tokens are stored hashed.
+    """
+    identities = {}
+    if os.path.exists(filepath):
+        try:
+            with open(filepath) as identityFile:
+                identities = json.load(identityFile)
+        except (IOError, ValueError):
+            identities = {}
+    identities[_tokenKey(token)] = {"id":user.id, "first_name":user.first_name,
+                                    "last_name":user.last_name, "username":user.username}
+    return _writeIdentities(filepath, identities)
+
+def forgetIdentity(filepath, token):
+    """
+    (str, str) -> None/True
+    Remove the bot information saved for 'token' (e.g. after the token was revoked).
+    """
+    if not os.path.exists(filepath):
+        return True
+    try:
+        with open(filepath) as identityFile:
+            identities = json.load(identityFile)
+    except (IOError, ValueError):
+        return None
+    if identities.pop(_tokenKey(token), None) is None:
+        return True
+    return _writeIdentities(filepath, identities)
+
+def _writeIdentities(filepath, identities):
+    tmpPath = filepath + ".tmp"
+    try:
+        with open(tmpPath, "w") as identityFile:
+            json.dump(identities, identityFile)
+        os.replace(tmpPath, filepath)
+    except IOError:
+        logging.warning("saveIdentity(): Could not write %s." %filepath)
+        return None
+    return True
+
+def _tokenKey(token):
+    import hashlib
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
@@ -0,0 +1,273 @@
+"""
+Caching helpers used by the Bot class.
+"""
+
+from collections import OrderedDict
+import logging
+import mmap
+import os
+import re
+import tempfile
+import threading
+import time
+
+
+class TTLCache:
+    """
+    Thread safe key/value cache where each entry expires 'ttl' seconds after being stored.
+    When 'max_entries' is reached the least recently used entry is dropped.
+
+        Attribute        Type        Description
+        ttl              float       default lifetime of an entry, in seconds
+        max_entries      int         maximum number of entries kept in memory
+        hits             int         number of successful lookups
+        misses           int         number of failed (absent or expired) lookups
+    """
+    def __init__(self, ttl, max_entries=1024):
+        """
+        (float, int) -> constructor
+        TTLCache class constructor.
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        (hashable, any) -> any
+        Return the value stored for 'key', or 'default' if it is absent or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value, ttl=None):
+        """
+        (hashable, any, float) -> None
+        Store 'value' for 'key'. 'ttl' overrides the default lifetime for this entry.
+        """
+        if ttl is None:
+            ttl = self.ttl
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key=None):
+        """
+        (hashable) -> None
+        Drop the entry for 'key', or every entry if no key is given.
+        """
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        """
+        () -> str
+        Formal representantion for TTLCache object
+        """
+        return "TTLCache(ttl=%s, entries=%d, hits=%d, misses=%d)" %(self.ttl, len(self._entries), self.hits, self.misses)
+
+
+class SingleFlight:
+    """
+    Folds concurrent calls sharing the same key into a single execution: the first
+    caller runs the function, the others wait for it and get the same result (or exception).
+    """
+    def __init__(self):
+        """
+        () -> constructor
+        SingleFlight class constructor.
+        """
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function, *args, **kwargs):
+        """
+        (hashable, callable, ...) -> any
+        Run function(*args, **kwargs) unless a call for 'key' is already in flight,
+        in which case wait for that call and return its result.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function(*args, **kwargs)
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def inFlight(self, key):
+        """
+        (hashable) -> bool
+        True if a call for 'key' is running.
+        """
+        with self._lock:
+            return key in self._calls
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MediaCache:
+    """
+    Directory of downloaded files keyed by file_unique_id (or file_id), bounded by total size.
+    Least recently used files are evicted first. Files are written to a temporary name and
+    renamed, so readers (even in other processes) never see partial downloads.
+
+        Attribute        Type        Description
+        directory        string      cache directory, created if needed
+        max_size         int         maximum total size of cached files, in bytes
+        size             int         current total size of cached files, in bytes
+    """
+    def __init__(self, directory, max_size=256 * 1024 * 1024):
+        """
+        (str, int) -> constructor
+        MediaCache class constructor. Files already in 'directory' are reused, oldest first for eviction.
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        found = []
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.startswith(".tmp-"):
+                #leftover of an interrupted download
+                os.remove(path)
+                continue
+            stat = os.stat(path)
+            found.append( (stat.st_mtime, name, stat.st_size) )
+        for mtime, name, fileSize in sorted(found):
+            self._entries[name] = fileSize
+            self.size += fileSize
+        self._evict()
+
+    def _name(self, key):
+        return re.sub(r"[^A-Za-z0-9_-]", "_", key)
+
+    def get(self, key):
+        """
+        (str) -> None/str
+        Return the path of the cached file for 'key', or None if it is not cached.
+        """
+        name = self._name(key)
+        with self._lock:
+            if name not in self._entries:
+                return None
+            self._entries.move_to_end(name)
+        path = os.path.join(self.directory, name)
+        try:
+            #keep LRU order across restarts
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.size -= self._entries.pop(name, 0)
+            return None
+        return path
+
+    def store(self, key, chunks):
+        """
+        (str, iterable of bytes) -> str
+        Atomically write 'chunks' as the cached file for 'key' and return its path.
+        """
+        name = self._name(key)
+        path = os.path.join(self.directory, name)
+        fd, tmpPath = tempfile.mkstemp(prefix=".tmp-", dir=self.directory)
+        fileSize = 0
+        try:
+            with os.fdopen(fd, "wb") as tmpFile:
+                for chunk in chunks:
+                    if chunk:
+                        tmpFile.write(chunk)
+                        fileSize += len(chunk)
+            os.replace(tmpPath, path)
+        except BaseException:
+            os.remove(tmpPath)
+            raise
+
+        with self._lock:
+            self.size -= self._entries.pop(name, 0)
+            self._entries[name] = fileSize
+            self.size += fileSize
+        self._evict()
+        return path
+
+    def mapped(self, key):
+        """
+        (str) -> None/mmap
+        Return a read only memory map of the cached file for 'key', or None if it is not cached
+        (or was evicted meanwhile).
+        """
+        path = self.get(key)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as cachedFile:
+                if os.fstat(cachedFile.fileno()).st_size == 0:
+                    #empty files can not be mapped
+                    return b""
+                return mmap.mmap(cachedFile.fileno(), 0, access=mmap.ACCESS_READ)
+        except OSError:
+            #evicted by a concurrent store() between get() and open()
+            logging.info("MediaCache: %s was evicted before it could be mapped." %key)
+            return None
+
+    def _evict(self):
+        with self._lock:
+            #never evict the most recent entry, even if it alone exceeds max_size
+            while self.size > self.max_size and len(self._entries) > 1:
+                name, fileSize = self._entries.popitem(last=False)
+                self.size -= fileSize
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    logging.warning("MediaCache: could not remove %s" %name)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        """
+        () -> str
+        Formal representantion for MediaCache object
+        """
+        return "MediaCache(%r, files=%d, size=%d/%d)" %(self.directory, len(self._entries), self.size, self.max_size)
@@ -0,0 +1,206 @@
+"""
+Deduplication of updates, so that each update_id is handled once even across
+restarts or when several pollers (hot standby) receive the same updates.
+
+Telegram update ids grow monotonically, so a sliding bitmap over the most recent
+ids is enough: memory is constant (size / 8 bytes per bot). Ids are not monotonic
+forever though: after a week without updates, Telegram may start again from a lower
+id. The time of the last new update is kept with the window: an id more than the
+window size below the highest one is taken for such a reset only after RESET_IDLE
+seconds without updates (the window is then cleared and starts again from it);
+otherwise it is an old update (e.g. a replayed recording) and considered already handled.
+
+An update is marked when it is received, before it is handled, so delivery is
+at most once: an update whose handler was interrupted (crash, restart) is not
+handled again by the next poller.
+"""
+
+import mmap
+import os
+import struct
+import threading
+import time
+
+#number of recent update ids remembered per bot
+WINDOW_SIZE = 1 << 16
+
+#Telegram may restart update ids after this long without updates
+RESET_IDLE = 7 * 24 * 60 * 60
+
+#highest id, size, time.time() of the last new update
+_HEADER = struct.Struct("<qqd")
+
+
+class UpdateWindow:
+    """
+    Sliding bitmap of the last 'size' update ids, ending at the highest id seen.
+    It can live in any writable buffer (bytearray, mmap) of windowBytes(size) bytes.
+
+        Attribute        Type        Description
+        size             int         number of ids in the window (multiple of 8)
+        high             int         highest id seen, -1 if none
+        last_mark        float       time.time() when the last new id was marked, 0 if none
+    """
+    def __init__(self, size=WINDOW_SIZE, buffer=None):
+        """
+        (int, bytearray/mmap) -> constructor
+        UpdateWindow class constructor. A 'buffer' with a valid header is reused as is.
+        """
+        if size % 8:
+            raise ValueError("UpdateWindow size must be a multiple of 8")
+        if buffer is None:
+            buffer = bytearray(windowBytes(size))
+        self._buffer = buffer
+        high, storedSize, lastMark = _HEADER.unpack_from(buffer, 0)
+        if storedSize != size:
+            #new or incompatible buffer
+            buffer[:] = bytes(len(buffer))
+            _HEADER.pack_into(buffer, 0, -1, size, 0.0)
+        self.size = size
+
+    @property
+    def high(self):
+        return _HEADER.unpack_from(self._buffer, 0)[0]
+
+    @property
+    def last_mark(self):
+        return _HEADER.unpack_from(self._buffer, 0)[2]
+
+    def check(self, update_id, now=None):
+        """
+        (int, float) -> bool
+        True if 'update_id' was not seen yet. Ids below the window are old updates,
+        unless the bot was idle for RESET_IDLE seconds before 'now' (time.time() by
+        default): then Telegram restarted the sequence and they are new.
+        """
+        high = self.high
+        if update_id > high:
+            return True
+        if update_id <= high - self.size:
+            return self._isReset(now)
+        index = _HEADER.size + (update_id % self.size) // 8
+        return not self._buffer[index] & (1 << (update_id % 8))
+
+    def _isReset(self, now):
+        if now is None:
+            now = time.time()
+        return now - self.last_mark >= RESET_IDLE
+
+    def mark(self, update_id, now=None):
+        """
+        (int, float) -> bool
+        Record 'update_id' as seen at 'now' (time.time() by default). Returns True if it
+        was not seen before.
+        """
+        if now is None:
+            now = time.time()
+        if not self.check(update_id, now):
+            return False
+        high = self.high
+        if update_id <= high - self.size:
+            #the update ids were reset: forget the old sequence
+            self._buffer[_HEADER.size:] = bytes(self.size // 8)
+            high = update_id
+        elif update_id > high:
+            #ids between the old and new high were not seen: clear their recycled bits
+            start = max(high + 1, update_id - self.size + 1)
+            for stale in range(start, update_id + 1):
+                index = _HEADER.size + (stale % self.size) // 8
+                self._buffer[index] &= ~(1 << (stale % 8)) & 0xFF
+            high = update_id
+        _HEADER.pack_into(self._buffer, 0, high, self.size, now)
+        index = _HEADER.size + (update_id % self.size) // 8
+        self._buffer[index] |= 1 << (update_id % 8)
+        return True
+
+
+def windowBytes(size):
+    """
+    (int) -> int
+    Bytes needed by an UpdateWindow of 'size' ids.
+    """
+    return _HEADER.size + size // 8
+
+
+class MemoryStore:
+    """
+    Keeps the windows in memory. Shared by every Bot of the process using it.
+    """
+    def __init__(self, size=WINDOW_SIZE):
+        """
+        (int) -> constructor
+        MemoryStore class constructor.
+        """
+        self.size = size
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def checkAndMark(self, key, update_id):
+        """
+        (str, int) -> bool
+        Atomically mark 'update_id' as seen for 'key'. Returns True if it is new.
+        """
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None:
+                window = self._windows[key] = UpdateWindow(self.size)
+            return window.mark(update_id)
+
+
+class FileStore:
+    """
+    Keeps one memory mapped window file per key in 'directory', locked with flock,
+    so several processes (restarts, standby pollers) share the same view. Unix only.
+    """
+    def __init__(self, directory, size=WINDOW_SIZE):
+        """
+        (str, int) -> constructor
+        FileStore class constructor.
+        """
+        import fcntl
+        self._fcntl = fcntl
+        self.directory = directory
+        self.size = size
+        os.makedirs(directory, exist_ok=True)
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def _open(self, key):
+        entry = self._files.get(key)
+        if entry is None:
+            path = os.path.join(self.directory, key + ".window")
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            self._fcntl.flock(fd, self._fcntl.LOCK_EX)
+            try:
+                if os.fstat(fd).st_size != windowBytes(self.size):
+                    os.ftruncate(fd, windowBytes(self.size))
+                buffer = mmap.mmap(fd, windowBytes(self.size))
+                window = UpdateWindow(self.size, buffer)
+            finally:
+                self._fcntl.flock(fd, self._fcntl.LOCK_UN)
+            entry = self._files[key] = (fd, window)
+        return entry
+
+    def checkAndMark(self, key, update_id):
+        """
+        (str, int) -> bool
+        Atomically mark 'update_id' as seen for 'key', across processes. Returns True if it is new.
+        """
+        with self._lock:
+            fd, window = self._open(key)
+            self._fcntl.flock(fd, self._fcntl.LOCK_EX)
+            try:
+                return window.mark(update_id)
+            finally:
+                self._fcntl.flock(fd, self._fcntl.LOCK_UN)
+
+    def close(self):
+        """
+        () -> None
+        Close every window file.
+        """
+        with self._lock:
+            for fd, window in self._files.values():
+                window._buffer.close()
+                os.close(fd)
+            self._files = {}
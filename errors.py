@@ -0,0 +1,137 @@
+"""
+Errors returned by the Bot API, as exceptions.
+
+Bot methods return None on failure; the TelegramError describing the failure is
+available from Bot.lastError(). With Bot(raise_errors=True) it is raised instead.
+"""
+
+
+class TelegramError(Exception):
+    """
+    Base class of every Bot API failure.
+
+        Attribute            Type        Optional
+        description          string      N
+        error_code           int         Y            * None for failures without a server answer
+        parameters           dict        N            * ResponseParameters sent with the error
+        method               string      Y            * API method that failed
+        retry_after          int         Y            * seconds to wait before retrying (flood control)
+        migrate_to_chat_id   int         Y            * new id of a group upgraded to a supergroup
+    """
+    #True if retrying the same request later may succeed
+    retryable = False
+
+    def __init__(self, description, error_code=None, parameters=None, method=None):
+        """
+        (str, int, dict, str) -> constructor
+        TelegramError class constructor.
+        """
+        Exception.__init__(self, description)
+        self.description = description
+        self.error_code = error_code
+        self.parameters = parameters or {}
+        self.method = method
+        self.retry_after = self.parameters.get("retry_after")
+        self.migrate_to_chat_id = self.parameters.get("migrate_to_chat_id")
+
+    def __str__(self):
+        """
+        () -> str
+        Human readable representation for TelegramError object
+        """
+        string = ""
+        if self.method != None:
+            string += self.method + ": "
+        if self.error_code != None:
+            string += "Error %d: " %self.error_code
+        return string + self.description
+
+    def __repr__(self):
+        return "%s(%r, error_code=%r, parameters=%r, method=%r)" %(
+            type(self).__name__, self.description, self.error_code, self.parameters, self.method)
+
+
+class NetworkError(TelegramError):
+    """
+    The request did not get an answer (timeout, connection error, invalid response).
+    """
+    retryable = True
+
+
+class BadRequest(TelegramError):
+    """
+    Error 400: the request is invalid (bad parameters, message not found...).
+    """
+
+
+class ChatMigrated(BadRequest):
+    """
+    The group was upgraded to a supergroup; use 'migrate_to_chat_id' instead.
+    """
+
+
+class Unauthorized(TelegramError):
+    """
+    Error 401: the bot token is invalid or was revoked.
+    """
+
+
+class Forbidden(TelegramError):
+    """
+    Error 403: the bot can not write to this chat (blocked by the user, kicked from the group...).
+    """
+
+
+class ChatBlocked(Forbidden):
+    """
+    The chat is known to have blocked the bot (see Bot.isBlocked); no request was made.
+    """
+
+
+class NotFound(TelegramError):
+    """
+    Error 404: unknown method or file.
+    """
+
+
+class Conflict(TelegramError):
+    """
+    Error 409: another getUpdates request or a webhook is active for this bot.
+    """
+    retryable = True
+
+
+class RetryAfter(TelegramError):
+    """
+    Error 429: flood control exceeded. Retry after 'retry_after' seconds.
+    """
+    retryable = True
+
+
+class ServerError(TelegramError):
+    """
+    Error 5xx: temporary Telegram failure.
+    """
+    retryable = True
+
+
+_BY_CODE = {400:BadRequest, 401:Unauthorized, 403:Forbidden, 404:NotFound, 409:Conflict, 429:RetryAfter}
+
+
+def errorFromResponse(answer, method=None):
+    """
+    (dict, str) -> TelegramError
+    Build the exception matching a Bot API answer with "ok" false.
+    """
+    error_code = answer.get("error_code")
+    parameters = answer.get("parameters") or {}
+    description = answer.get("description", "Unknown error")
+    if "migrate_to_chat_id" in parameters:
+        errorClass = ChatMigrated
+    elif "retry_after" in parameters:
+        errorClass = RetryAfter
+    elif error_code is not None and error_code >= 500:
+        errorClass = ServerError
+    else:
+        errorClass = _BY_CODE.get(error_code, TelegramError)
+    return errorClass(description, error_code, parameters, method)
@@ -0,0 +1,158 @@
+"""
+Streaming export of Message records for analytics.
+
+Messages are flattened to one record per message and written in batches, so memory
+use does not depend on the size of the history. Parquet is used when pyarrow is
+installed, line delimited JSON (NDJSON, optionally gzip compressed) otherwise.
+"""
+
+import gzip
+import json
+import logging
+import time
+
+#column name -> arrow type name
+FIELDS = [
+    ("message_id", "int64"),
+    ("chat_id", "int64"),
+    ("chat_type", "string"),
+    ("user_id", "int64"),
+    ("type", "string"),
+    ("date", "int64"),
+    ("forwarded", "bool_"),
+    ("reply_to_message_id", "int64"),
+    ("text_length", "int64"),
+    ("file_size", "int64"),
+    ("width", "int64"),
+    ("height", "int64"),
+    ("duration", "int64"),
+    ("mime_type", "string"),
+]
+
+
+def messageRecord(message):
+    """
+    (Message) -> dict
+    Flat representation of a message with the FIELDS columns. Missing values are None.
+    For photos, sizes are those of the largest PhotoSize.
+    """
+    content = message.content
+    if message.type == "photo" and content:
+        content = max(content, key=lambda size: size.width * size.height)
+    record = {
+        "message_id":message.message_id,
+        "chat_id":message.chat.id,
+        "chat_type":message.chat.type,
+        "user_id":message.from_user.id,
+        "type":message.type,
+        "date":int(time.mktime(message.date.timetuple())),
+        "forwarded":message.forwarded,
+        "reply_to_message_id":message.reply_to_message.message_id if message.reply else None,
+        "text_length":len(content) if message.type == "text" else None,
+    }
+    for field in ("file_size", "width", "height", "duration", "mime_type"):
+        record[field] = getattr(content, field, None)
+    return record
+
+
+class MessageExporter:
+    """
+    Writes Message records to 'filepath' in batches of 'batch_size'.
+    Use as a context manager, or call close() when done.
+
+        Attribute        Type        Description
+        filepath         string      output file
+        format           string      "parquet" or "ndjson"
+        batch_size       int         records kept in memory before being written
+        count            int         number of records written so far
+    """
+    def __init__(self, filepath, format=None, batch_size=1000):
+        """
+        (str, str, int) -> constructor
+        MessageExporter class constructor. 'format' defaults to "parquet" for ".parquet"
+        files and "ndjson" otherwise. If pyarrow is not installed, Parquet falls back to
+        NDJSON written to 'filepath' with ".ndjson" appended.
+        """
+        if format is None:
+            format = "parquet" if filepath.endswith(".parquet") else "ndjson"
+        if format == "parquet":
+            try:
+                import pyarrow
+                import pyarrow.parquet
+            except ImportError:
+                logging.warning("MessageExporter: pyarrow is not installed, falling back to NDJSON.")
+                format = "ndjson"
+                filepath += ".ndjson"
+
+        self.filepath = filepath
+        self.format = format
+        self.batch_size = batch_size
+        self.count = 0
+        self._batch = []
+
+        if format == "parquet":
+            self._pyarrow = pyarrow
+            self._schema = pyarrow.schema([(name, getattr(pyarrow, typeName)()) for name, typeName in FIELDS])
+            self._writer = pyarrow.parquet.ParquetWriter(filepath, self._schema)
+        elif filepath.endswith(".gz"):
+            self._writer = gzip.open(filepath, "wt", encoding="utf-8")
+        else:
+            self._writer = open(filepath, "w", encoding="utf-8")
+
+    def write(self, message):
+        """
+        (Message) -> None
+        Add one message to the export.
+        """
+        self._batch.append(messageRecord(message))
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def writeAll(self, messages):
+        """
+        (iterable of Message) -> int
+        Add every message of 'messages' (which may be a generator). Returns the number written.
+        """
+        before = self.count + len(self._batch)
+        for message in messages:
+            self.write(message)
+        return self.count + len(self._batch) - before
+
+    def flush(self):
+        """
+        () -> None
+        Write the pending batch (a Parquet row group, or NDJSON lines).
+        """
+        if not self._batch:
+            return
+        if self.format == "parquet":
+            columns = {name:[record[name] for record in self._batch] for name, typeName in FIELDS}
+            self._writer.write_table(self._pyarrow.Table.from_pydict(columns, schema=self._schema))
+        else:
+            self._writer.write("".join(json.dumps(record, separators=(",", ":")) + "\n" for record in self._batch))
+        self.count += len(self._batch)
+        self._batch = []
+
+    def close(self):
+        """
+        () -> None
+        Write pending records and close the file.
+        """
+        self.flush()
+        self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+
+def exportMessages(messages, filepath, format=None, batch_size=1000):
+    """
+    (iterable of Message, str, str, int) -> int
+    Export 'messages' to 'filepath' (see MessageExporter). Returns the number of records.
+    """
+    with MessageExporter(filepath, format=format, batch_size=batch_size) as exporter:
+        exporter.writeAll(messages)
+    return exporter.count
@@ -0,0 +1,250 @@
+"""
+Spatial index of Location objects, for bots matching users to nearby points
+(stores, drivers, other users) without scanning every point.
+"""
+
+import itertools
+import math
+import threading
+
+from .middleware import Middleware
+from .types import Location
+
+#mean Earth radius, in meters
+EARTH_RADIUS = 6371008.8
+#default grid cell side, in degrees (about 11 km of latitude)
+CELL_SIZE = 0.1
+
+
+def haversine(latitude1, longitude1, latitude2, longitude2):
+    """
+    (float, float, float, float) -> float
+    Great circle distance between two points, in meters.
+    """
+    lat1 = math.radians(latitude1)
+    lat2 = math.radians(latitude2)
+    a = (math.sin((lat2 - lat1) / 2) ** 2 +
+         math.cos(lat1) * math.cos(lat2) * math.sin(math.radians(longitude2 - longitude1) / 2) ** 2)
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def boundingBoxes(latitude, longitude, radius):
+    """
+    (float, float, float) -> [(float, float, float, float)]
+    Boxes (min latitude, min longitude, max latitude, max longitude) covering every point
+    within 'radius' meters. Two boxes when the circle crosses the 180th meridian.
+    """
+    angle = radius / EARTH_RADIUS
+    if angle >= math.pi:
+        return [(-90.0, -180.0, 90.0, 180.0)]
+    delta = math.degrees(angle)
+    south = latitude - delta
+    north = latitude + delta
+    if south <= -90.0 or north >= 90.0:
+        #the circle contains a pole: every longitude
+        return [(max(south, -90.0), -180.0, min(north, 90.0), 180.0)]
+    width = math.degrees(math.asin(min(1.0, math.sin(angle) / math.cos(math.radians(latitude)))))
+    west = longitude - width
+    east = longitude + width
+    if west < -180.0:
+        return [(south, west + 360.0, north, 180.0), (south, -180.0, north, east)]
+    if east > 180.0:
+        return [(south, west, north, 180.0), (south, -180.0, north, east - 360.0)]
+    return [(south, west, north, east)]
+
+
+class LocationIndex:
+    """
+    Points (Location objects) indexed by key, with radius and k-nearest queries by great
+    circle distance. Points are kept in grid buckets of 'cell_size' degrees; when the
+    optional rtree package is installed (and 'use_rtree' is not False) an R-tree is used
+    instead. Both give exact answers. Thread safe.
+
+        Attribute        Type        Description
+        cell_size        float       side of the grid buckets, in degrees
+        rtree            bool        True if the R-tree backend is used
+    """
+    def __init__(self, cell_size=CELL_SIZE, use_rtree=None):
+        """
+        (float, bool) -> constructor
+        LocationIndex class constructor. 'use_rtree' None uses rtree if it is installed.
+        """
+        self.cell_size = cell_size
+        #key -> (latitude, longitude)
+        self._points = {}
+        self._lock = threading.RLock()
+        self._tree = None
+        if use_rtree is not False:
+            try:
+                from rtree import index
+                self._tree = index.Index()
+                #rtree needs integer ids
+                self._ids = {}
+                self._keys = {}
+                self._nextId = itertools.count()
+            except ImportError:
+                if use_rtree:
+                    raise
+        self.rtree = self._tree is not None
+        #grid buckets: (row, column) -> set of keys
+        self._cells = {}
+
+    def __len__(self):
+        return len(self._points)
+
+    def __contains__(self, key):
+        return key in self._points
+
+    def get(self, key):
+        """
+        (hashable) -> None/Location
+        Location of 'key', None if it is not indexed.
+        """
+        point = self._points.get(key)
+        if point is None:
+            return None
+        return Location({"latitude":point[0], "longitude":point[1]})
+
+    def update(self, key, location):
+        """
+        (hashable, Location) -> None
+        Index 'location' under 'key', replacing its previous location.
+        """
+        latitude, longitude = location.latitude, location.longitude
+        with self._lock:
+            self._remove(key)
+            self._points[key] = (latitude, longitude)
+            if self._tree is not None:
+                treeId = next(self._nextId)
+                self._ids[key] = treeId
+                self._keys[treeId] = key
+                self._tree.insert(treeId, (longitude, latitude, longitude, latitude))
+            else:
+                cell = self._cell(latitude, longitude)
+                keys = self._cells.get(cell)
+                if keys is None:
+                    keys = self._cells[cell] = set()
+                keys.add(key)
+
+    def remove(self, key):
+        """
+        (hashable) -> bool
+        Remove 'key' from the index. Returns False if it was not indexed.
+        """
+        with self._lock:
+            return self._remove(key)
+
+    def within(self, location, radius):
+        """
+        (Location, float) -> [(hashable, float)]
+        Keys within 'radius' meters of 'location' and their distances, nearest first.
+        """
+        latitude, longitude = location.latitude, location.longitude
+        found = []
+        with self._lock:
+            for box in boundingBoxes(latitude, longitude, radius):
+                for key in self._inBox(box):
+                    point = self._points[key]
+                    distance = haversine(latitude, longitude, point[0], point[1])
+                    if distance <= radius:
+                        found.append( (key, distance) )
+        found.sort(key=lambda item: item[1])
+        return found
+
+    def nearest(self, location, k=1, max_distance=None):
+        """
+        (Location, int, float) -> [(hashable, float)]
+        The 'k' keys nearest to 'location' and their distances, nearest first, optionally
+        limited to 'max_distance' meters.
+        """
+        latitude, longitude = location.latitude, location.longitude
+        with self._lock:
+            if len(self._points) <= k:
+                found = [(key, haversine(latitude, longitude, point[0], point[1]))
+                         for key, point in self._points.items()]
+                found.sort(key=lambda item: item[1])
+            elif self._tree is not None:
+                #the k nearest in degrees give an upper bound of the k-th distance
+                candidates = itertools.islice(self._tree.nearest((longitude, latitude, longitude, latitude), k), k)
+                radius = max(haversine(latitude, longitude, *self._points[self._keys[treeId]])
+                             for treeId in candidates)
+                if max_distance is not None:
+                    radius = min(radius, max_distance)
+                found = self.within(location, radius)
+            else:
+                #grow the search radius until it holds k points
+                radius = self.cell_size * math.pi / 180 * EARTH_RADIUS
+                while True:
+                    if max_distance is not None and radius >= max_distance:
+                        found = self.within(location, max_distance)
+                        break
+                    found = self.within(location, radius)
+                    if len(found) >= k or radius >= math.pi * EARTH_RADIUS:
+                        break
+                    radius *= 2
+        if max_distance is not None:
+            found = [item for item in found if item[1] <= max_distance]
+        return found[:k]
+
+    def _cell(self, latitude, longitude):
+        return (int(math.floor(latitude / self.cell_size)), int(math.floor(longitude / self.cell_size)))
+
+    def _remove(self, key):
+        #called with the lock held
+        point = self._points.pop(key, None)
+        if point is None:
+            return False
+        if self._tree is not None:
+            treeId = self._ids.pop(key)
+            del self._keys[treeId]
+            self._tree.delete(treeId, (point[1], point[0], point[1], point[0]))
+        else:
+            cell = self._cell(*point)
+            keys = self._cells[cell]
+            keys.discard(key)
+            if not keys:
+                del self._cells[cell]
+        return True
+
+    def _inBox(self, box):
+        #called with the lock held: keys of the points that may be in 'box'
+        south, west, north, east = box
+        if self._tree is not None:
+            return [self._keys[treeId] for treeId in self._tree.intersection((west, south, east, north))]
+        rowMin, columnMin = self._cell(south, west)
+        rowMax, columnMax = self._cell(north, east)
+        keys = []
+        if (rowMax - rowMin + 1) * (columnMax - columnMin + 1) > len(self._cells):
+            #a large box: cheaper to go through the non empty buckets
+            for (row, column), cellKeys in self._cells.items():
+                if rowMin <= row <= rowMax and columnMin <= column <= columnMax:
+                    keys.extend(cellKeys)
+        else:
+            for row in range(rowMin, rowMax + 1):
+                for column in range(columnMin, columnMax + 1):
+                    cellKeys = self._cells.get( (row, column) )
+                    if cellKeys:
+                        keys.extend(cellKeys)
+        return keys
+
+
+class TrackLocations(Middleware):
+    """
+    Middleware keeping a LocationIndex up to date with the location messages received:
+    each one moves its sender to the new location. With 'key', the index key is
+    key(messageData) instead, computed from the raw message dict.
+    """
+    def __init__(self, index, key=None):
+        """
+        (LocationIndex, callable) -> constructor
+        TrackLocations class constructor.
+        """
+        self.index = index
+        self.key = key
+
+    def onUpdate(self, bot, updateData):
+        message = updateData.get("message")
+        if message is not None and "location" in message:
+            key = self.key(message) if self.key is not None else message["from"]["id"]
+            self.index.update(key, Location(message["location"]))
+        return True
@@ -0,0 +1,169 @@
+"""
+Pipelined polling: the next getUpdates request is on the wire while the previous
+batch is still being parsed and handled.
+"""
+
+import logging
+import queue
+import threading
+import time
+
+from .errors import TelegramError
+
+
+class PipelinedPoller:
+    """
+    Polls one bot with a fetcher thread and hands the raw updates to 'workers' consumer
+    threads through a queue of at most 'queue_size' updates. Consumers run
+    Bot.processUpdate and then handler(bot, message) through the bot's middlewares.
+    When handlers fall behind the queue fills up and the fetcher waits, so memory stays
+    bounded; Telegram keeps the updates not fetched yet. Messages are not appended to
+    bot.messages unless 'store' is True (that list grows until bot.flushMessages()).
+    Failed getUpdates requests, raised or not (see Bot 'raise_errors'), are retried
+    after 'interval' seconds.
+
+    The offset is advanced as soon as a batch is fetched (the next request must not
+    return it again), so updates still queued when the process dies are lost: call
+    stop() to drain the queue, or use a dedup store and replay from a recording.
+    With more than one worker, messages may be handled out of order.
+
+        Attribute        Type        Description
+        bot              Bot         bot to poll
+        handler          callable    called as handler(bot, message)
+        timeout          int         long polling timeout, in seconds
+        queue_size       int         maximum number of updates fetched but not handled yet
+        workers          int         number of consumer threads
+        interval         float       pause after a failed poll, or an empty one when not long polling, in seconds
+        store            bool        True to also keep the messages in bot.messages
+    """
+    def __init__(self, bot, handler, timeout=20, queue_size=1000, workers=1, interval=1.0, store=False):
+        """
+        (Bot, callable, int, int, int, float, bool) -> constructor
+        PipelinedPoller class constructor.
+        """
+        self.bot = bot
+        self.handler = handler
+        self.timeout = timeout
+        self.queue_size = queue_size
+        self.workers = workers
+        self.interval = interval
+        self.store = store
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._threads = []
+        self._fetcher = None
+        self._running = False
+        self._lock = threading.Lock()
+        self._counters = {"polls":0, "fetched":0, "handled":0, "errors":0,
+                          "fetch_time":0.0, "handle_time":0.0, "blocked_time":0.0}
+
+    def start(self):
+        """
+        () -> None
+        Start the fetcher and the consumer threads.
+        """
+        if self._running:
+            return
+        self._running = True
+        self._fetcher = threading.Thread(target=self._fetch, name="PipelinedPollerFetcher", daemon=True)
+        self._threads = [self._fetcher]
+        for index in range(self.workers):
+            self._threads.append(threading.Thread(target=self._consume, name="PipelinedPollerWorker-%d" %index,
+                                                  daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, wait=True):
+        """
+        (bool) -> None
+        Stop fetching. Updates already fetched are still handled. If 'wait' is True, block
+        until they are (the fetcher may first finish its current long poll).
+        """
+        self._running = False
+        if wait:
+            for thread in self._threads:
+                thread.join()
+        self._threads = []
+
+    def run(self):
+        """
+        () -> None
+        Poll until interrupted (KeyboardInterrupt), then stop.
+        """
+        self.start()
+        try:
+            while self._running:
+                time.sleep(1.0)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stats(self):
+        """
+        () -> dict
+        Polls made, updates fetched and handled, handler errors, updates waiting in the
+        queue, and seconds spent fetching, handling and with the fetcher blocked on a full queue.
+        """
+        with self._lock:
+            stats = dict(self._counters)
+        stats["queued"] = self._queue.qsize()
+        return stats
+
+    def _count(self, name, value):
+        with self._lock:
+            self._counters[name] += value
+
+    def _fetch(self):
+        try:
+            self._fetchLoop()
+        except Exception:
+            #stop, so the consumers drain the queue and exit instead of waiting forever
+            logging.exception("PipelinedPoller: fetcher stopped by an exception.")
+            self._running = False
+
+    def _fetchLoop(self):
+        while self._running:
+            start = time.perf_counter()
+            try:
+                updates = self.bot.fetchUpdates(self.timeout)
+            except TelegramError as error:
+                #raised instead of returned with raise_errors
+                logging.warning("PipelinedPoller: getUpdates failed: %s" %error)
+                updates = None
+            self._count("fetch_time", time.perf_counter() - start)
+            self._count("polls", 1)
+            if updates is None:
+                #failed request (see bot.lastError()): do not hammer the server
+                time.sleep(self.interval)
+                continue
+            if not updates:
+                if not self.timeout:
+                    time.sleep(self.interval)
+                continue
+            #the next request starts after this batch, whatever happens to it here
+            self.bot.advanceOffset(max(update["update_id"] for update in updates))
+            self._count("fetched", len(updates))
+            start = time.perf_counter()
+            for update in updates:
+                #blocks while the queue is full: backpressure on the fetcher
+                self._queue.put(update)
+            self._count("blocked_time", time.perf_counter() - start)
+
+    def _consume(self):
+        while True:
+            try:
+                update = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                if not self._running and not self._fetcher.is_alive():
+                    return
+                continue
+            start = time.perf_counter()
+            try:
+                message = self.bot.processUpdate(update, store=self.store)
+                if message is not None:
+                    self.bot.dispatch(self.handler, message)
+            except Exception:
+                logging.exception("PipelinedPoller: handler raised an exception.")
+                self._count("errors", 1)
+            self._count("handle_time", time.perf_counter() - start)
+            self._count("handled", 1)
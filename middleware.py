@@ -0,0 +1,200 @@
+"""
+Middleware chain between incoming updates and message handlers.
+
+A middleware subclasses Middleware and overrides any of its hooks. Hooks can be
+plain methods or coroutines (async def); coroutines run on an event loop owned by
+the pipeline, so handlers and middlewares can be mixed freely.
+"""
+
+import asyncio
+import inspect
+import logging
+import threading
+import time
+
+
+class Middleware:
+    """
+    Base class for middlewares. Every hook is optional.
+    """
+    def onUpdate(self, bot, updateData):
+        """
+        (Bot, dict) -> bool
+        Called with the raw update, before it is parsed. Return False to drop it:
+        no Message is built and no handler runs. Keep it cheap. Exceptions are logged
+        and the update goes on to the next middleware.
+        """
+        return True
+
+    def before(self, bot, message):
+        """
+        (Bot, Message) -> bool
+        Called before the handler. Return False to skip the handler (and the
+        remaining 'before' hooks); 'after' hooks of the middlewares already run still run.
+        Return a number of seconds to defer the message instead: it is skipped now and
+        the whole chain runs again for it after that delay, from a timer thread.
+        """
+        return True
+
+    def after(self, bot, message, result, error):
+        """
+        (Bot, Message, any, Exception) -> None
+        Called after the handler, in reverse order, with its result or the exception it raised.
+        """
+        pass
+
+
+class _Timing:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, elapsed):
+        self.count += 1
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+
+
+class MiddlewarePipeline:
+    """
+    Ordered list of middlewares, with the time spent in each of them.
+
+        Attribute        Type            Description
+        middlewares      [Middleware]    middlewares, in the order they were added
+        dropped          int             number of updates dropped by onUpdate hooks
+        skipped          int             number of messages whose handler was skipped
+        deferred         int             number of messages deferred by 'before' hooks
+    """
+    def __init__(self):
+        """
+        () -> constructor
+        MiddlewarePipeline class constructor.
+        """
+        self.middlewares = []
+        self.dropped = 0
+        self.skipped = 0
+        self.deferred = 0
+        self._names = []
+        self._timings = {}
+        self._lock = threading.Lock()
+        self._loop = None
+
+    def add(self, middleware):
+        """
+        (Middleware) -> None
+        Append 'middleware' to the chain.
+        """
+        name = type(middleware).__name__
+        if name in self._names:
+            name += "#%d" %(len(self.middlewares) + 1)
+        self.middlewares.append(middleware)
+        self._names.append(name)
+
+    def filterUpdate(self, bot, updateData):
+        """
+        (Bot, dict) -> bool
+        Run the onUpdate hooks. Returns False if one of them dropped the update.
+        """
+        for name, middleware in zip(self._names, self.middlewares):
+            if type(middleware).onUpdate is Middleware.onUpdate:
+                continue
+            try:
+                kept = self._timed(name + ".onUpdate", middleware.onUpdate, bot, updateData)
+            except Exception:
+                #a broken hook must not stop the polling loop
+                logging.exception("MiddlewarePipeline: %s.onUpdate raised an exception." %name)
+                continue
+            if kept is False:
+                with self._lock:
+                    self.dropped += 1
+                return False
+        return True
+
+    def dispatch(self, bot, message, handler):
+        """
+        (Bot, Message, callable) -> any
+        Run the 'before' hooks, handler(bot, message) and the 'after' hooks.
+        Returns the handler result (None if skipped); exceptions of the handler are re-raised.
+        """
+        entered = []
+        result = None
+        error = None
+        try:
+            for name, middleware in zip(self._names, self.middlewares):
+                entered.append( (name, middleware) )
+                if type(middleware).before is Middleware.before:
+                    continue
+                verdict = self._timed(name + ".before", middleware.before, bot, message)
+                if verdict is False:
+                    with self._lock:
+                        self.skipped += 1
+                    break
+                if type(verdict) in (int, float):
+                    #deferred: no worker waits, a timer dispatches the message again
+                    with self._lock:
+                        self.deferred += 1
+                    timer = threading.Timer(verdict, self._redispatch, (bot, message, handler))
+                    timer.daemon = True
+                    timer.start()
+                    break
+            else:
+                result = self._timed("handler", handler, bot, message)
+        except Exception as exception:
+            error = exception
+
+        for name, middleware in reversed(entered):
+            if type(middleware).after is Middleware.after:
+                continue
+            try:
+                self._timed(name + ".after", middleware.after, bot, message, result, error)
+            except Exception:
+                logging.exception("MiddlewarePipeline: %s.after raised an exception." %name)
+        if error is not None:
+            raise error
+        return result
+
+    def _redispatch(self, bot, message, handler):
+        try:
+            self.dispatch(bot, message, handler)
+        except Exception:
+            logging.exception("MiddlewarePipeline: handler of a deferred message raised an exception.")
+
+    def stats(self):
+        """
+        () -> dict
+        For each hook ("Name.onUpdate", "Name.before", "Name.after") and for "handler":
+        number of calls, total, mean and max time in seconds.
+        """
+        with self._lock:
+            return {name:{"count":timing.count, "total":timing.total,
+                          "mean":timing.total / timing.count if timing.count else 0.0,
+                          "max":timing.max}
+                    for name, timing in self._timings.items()}
+
+    def _timed(self, name, function, *args):
+        start = time.perf_counter()
+        try:
+            result = function(*args)
+            if inspect.isawaitable(result):
+                result = self._runAsync(result)
+            return result
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                timing = self._timings.get(name)
+                if timing is None:
+                    timing = self._timings[name] = _Timing()
+                timing.add(elapsed)
+
+    def _runAsync(self, awaitable):
+        #coroutines run on a private event loop thread shared by every caller
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="MiddlewareLoop", daemon=True).start()
+
+        async def wrap():
+            return await awaitable
+        return asyncio.run_coroutine_threadsafe(wrap(), self._loop).result()
@@ -0,0 +1,187 @@
+"""
+Polling many bots from a small shared thread pool.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+
+
+class _PollState:
+    def __init__(self, bot, interval):
+        self.bot = bot
+        self.interval = interval
+        self.hot = False
+        self.active = True
+        self.polls = 0
+        self.empty_polls = 0
+
+
+class AdaptivePoller:
+    """
+    Polls a set of bots with a shared pool of 'workers' threads, adapting each bot's
+    cadence to its traffic. Quiet bots are polled with short requests at an interval
+    that grows by 'backoff' after each empty poll, up to 'max_interval'. A bot that
+    receives updates becomes "hot" and is long polled (up to 'max_long_polls' at once)
+    until a long poll returns nothing, then backs off again.
+    Every new message is passed to handler(bot, message) on the worker thread,
+    through the middlewares of the bot (see Bot.use).
+
+        Attribute        Type        Description
+        handler          callable    called as handler(bot, message)
+        workers          int         size of the shared thread pool
+        min_interval     float       polling interval right after traffic, in seconds
+        max_interval     float       longest interval between two polls of a quiet bot
+        backoff          float       interval multiplier after an empty or failed poll
+        long_poll        int         long polling timeout for hot bots, in seconds (0 disables)
+        max_long_polls   int         maximum number of simultaneous long polls
+    """
+    def __init__(self, handler, workers=4, min_interval=1.0, max_interval=60.0, backoff=2.0,
+                 long_poll=20, max_long_polls=None):
+        """
+        (callable, int, float, float, float, int, int) -> constructor
+        AdaptivePoller class constructor. 'max_long_polls' defaults to half of the workers,
+        so long polls never block the short polls of quiet bots.
+        """
+        self.handler = handler
+        self.workers = workers
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.long_poll = long_poll
+        if max_long_polls is None:
+            max_long_polls = max(1, workers // 2)
+        self.max_long_polls = max_long_polls
+
+        self._states = {}
+        self._heap = []
+        self._sequence = itertools.count()
+        self._long_polls = 0
+        self._lock = threading.Condition()
+        self._executor = None
+        self._scheduler = None
+        self._running = False
+
+    def add(self, bot):
+        """
+        (Bot) -> None
+        Start polling 'bot'. Its first poll happens right away.
+        """
+        with self._lock:
+            if id(bot) in self._states:
+                return
+            state = self._states[id(bot)] = _PollState(bot, self.min_interval)
+            self._schedule(state, 0)
+
+    def remove(self, bot):
+        """
+        (Bot) -> None
+        Stop polling 'bot'. A poll already running finishes normally.
+        """
+        with self._lock:
+            state = self._states.pop(id(bot), None)
+            if state is not None:
+                state.active = False
+
+    def start(self):
+        """
+        () -> None
+        Start the scheduler thread and the worker pool.
+        """
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="AdaptivePoller")
+            self._scheduler = threading.Thread(target=self._run, name="AdaptivePollerScheduler", daemon=True)
+            self._scheduler.start()
+
+    def stop(self, wait=True):
+        """
+        (bool) -> None
+        Stop polling. If 'wait' is True, block until running polls finish.
+        """
+        with self._lock:
+            self._running = False
+            self._lock.notify()
+        if self._scheduler is not None:
+            self._scheduler.join()
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+
+    def stats(self):
+        """
+        () -> dict
+        Number of bots, hot bots, running long polls and per bot (polls, empty polls, interval).
+        """
+        with self._lock:
+            return {"bots":len(self._states),
+                    "hot":sum(1 for state in self._states.values() if state.hot),
+                    "long_polls":self._long_polls,
+                    "intervals":{state.bot.token[:10]:(state.polls, state.empty_polls, state.interval)
+                                 for state in self._states.values()}}
+
+    def _schedule(self, state, delay):
+        #called with the lock held
+        heapq.heappush(self._heap, (time.monotonic() + delay, next(self._sequence), state))
+        self._lock.notify()
+
+    def _run(self):
+        with self._lock:
+            while self._running:
+                if not self._heap:
+                    self._lock.wait()
+                    continue
+                due, sequence, state = self._heap[0]
+                now = time.monotonic()
+                if due > now:
+                    self._lock.wait(due - now)
+                    continue
+                heapq.heappop(self._heap)
+                if not state.active:
+                    continue
+                timeout = 0
+                if state.hot and self.long_poll and self._long_polls < self.max_long_polls:
+                    timeout = self.long_poll
+                    self._long_polls += 1
+                self._executor.submit(self._poll, state, timeout)
+
+    def _poll(self, state, timeout):
+        messages = None
+        try:
+            messages = state.bot.pollUpdates(timeout)
+            if messages:
+                for message in messages:
+                    try:
+                        state.bot.dispatch(self.handler, message)
+                    except Exception:
+                        logging.exception("AdaptivePoller: handler raised an exception.")
+        except Exception:
+            logging.exception("AdaptivePoller: error while polling.")
+        finally:
+            with self._lock:
+                if timeout:
+                    self._long_polls -= 1
+                state.polls += 1
+                if messages:
+                    #traffic: poll again right away, with long polling
+                    state.hot = True
+                    state.interval = self.min_interval
+                    delay = 0
+                else:
+                    if messages is not None:
+                        state.empty_polls += 1
+                    if state.hot and messages is not None:
+                        #a poll without updates: the bot is quiet again
+                        state.hot = False
+                        state.interval = self.min_interval
+                    else:
+                        state.interval = min(state.interval * self.backoff, self.max_interval)
+                    #jitter keeps many quiet bots from polling in lockstep
+                    delay = state.interval * random.uniform(0.9, 1.1)
+                if state.active and self._running:
+                    self._schedule(state, delay)
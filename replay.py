@@ -0,0 +1,287 @@
+"""
+Record incoming updates and replay them offline, to load test message handlers
+without a Telegram account.
+
+Recordings are append-only, one compact JSON object per line:
+    {"t": <time received>, "u": <update exactly as sent by Telegram>}
+Files ending with ".gz" are gzip compressed.
+"""
+
+import gzip
+import itertools
+import json
+import logging
+import threading
+import time
+
+from .transport import Transport
+
+
+def _open(filepath, mode):
+    if filepath.endswith(".gz"):
+        return gzip.open(filepath, mode + "t", encoding="utf-8")
+    return open(filepath, mode, encoding="utf-8")
+
+
+class Recorder:
+    """
+    Appends raw updates (getUpdates results or webhook bodies) to a recording file.
+
+        Attribute        Type        Description
+        filepath         string      recording file
+        count            int         number of updates written by this recorder
+    """
+    def __init__(self, filepath):
+        """
+        (str) -> constructor
+        Recorder class constructor. An existing recording is appended to.
+        """
+        self.filepath = filepath
+        self.count = 0
+        self._file = _open(filepath, "a")
+        self._lock = threading.Lock()
+
+    def write(self, updateData, received=None):
+        """
+        (dict, float) -> None
+        Append one update. 'received' defaults to the current time.
+        """
+        if received is None:
+            received = time.time()
+        line = json.dumps({"t":round(received, 3), "u":updateData}, separators=(",", ":"))
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            self.count += 1
+
+    def close(self):
+        """
+        () -> None
+        Close the recording file.
+        """
+        with self._lock:
+            self._file.close()
+
+
+def readRecording(filepath):
+    """
+    (str) -> iterator of (float, dict)
+    Yield (time received, update) pairs from a recording, in order.
+    """
+    with _open(filepath, "r") as recording:
+        for line in recording:
+            if line.strip():
+                entry = json.loads(line)
+                yield entry["t"], entry["u"]
+
+
+class FakeAPI(Transport):
+    """
+    Stand-in for the transport of a Bot: answers every API call locally with a
+    plausible successful result and counts the calls.
+
+        Attribute        Type        Description
+        latency          float       simulated network time for each call, in seconds
+        calls            dict        number of calls for each API method
+    """
+    def __init__(self, latency=0.0):
+        """
+        (float) -> constructor
+        FakeAPI class constructor.
+        """
+        self.latency = latency
+        self.calls = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _count(self, url):
+        method = url.rstrip("/").rsplit("/", 1)[-1]
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+        return method
+
+    def call(self, url, parameters=None, files=None, post=False, timeout=None):
+        method = self._count(url)
+        return {"ok":True, "result":self._result(method, parameters or {})}
+
+    def download(self, url, chunk_size, timeout=None):
+        self._count(url)
+        return 200, iter([b"\0" * min(chunk_size, 1024)])
+
+    def _result(self, method, parameters):
+        me = {"id":0, "first_name":"Replay", "username":"replay_bot"}
+        if method == "getMe":
+            return me
+        if method == "getUpdates":
+            return []
+        if method == "getFile":
+            return {"file_id":parameters.get("file_id"), "file_path":"replay/" + str(parameters.get("file_id"))}
+        if method == "sendMediaGroup":
+            return [self._message(me, parameters) for item in json.loads(parameters["media"])]
+        if method.startswith("send") and method != "sendChatAction" or method.startswith("forward"):
+            return self._message(me, parameters)
+        if method.startswith("edit") and "inline_message_id" not in parameters:
+            #edits of chat messages return the edited message, inline ones True
+            edited = self._message(me, parameters)
+            edited["message_id"] = parameters.get("message_id", edited["message_id"])
+            edited["text"] = parameters.get("text", "")
+            return edited
+        return True
+
+    def _message(self, me, parameters):
+        return {"message_id":next(self._ids), "from":me, "date":int(time.time()),
+                "chat":{"id":parameters.get("chat_id", 0), "type":"private"}, "text":""}
+
+    def total(self):
+        """
+        () -> int
+        Total number of API calls.
+        """
+        return sum(self.calls.values())
+
+
+class ReplayReport:
+    """
+    Result of Replayer.run().
+
+        Attribute        Type        Description
+        updates          int         number of updates replayed
+        handled          int         number of messages passed to the handler
+        errors           int         number of handler calls that raised an exception
+        duration         float       wall time of the replay, in seconds
+        latencies        [float]     per message time from scheduled arrival to end of handling, in seconds
+        api_calls        dict        outbound API calls by method
+    """
+    def __init__(self, updates, handled, errors, duration, latencies, api_calls):
+        self.updates = updates
+        self.handled = handled
+        self.errors = errors
+        self.duration = duration
+        self.latencies = sorted(latencies)
+        self.api_calls = api_calls
+
+    def throughput(self):
+        """
+        () -> float
+        Handled messages per second.
+        """
+        if self.duration == 0:
+            return 0.0
+        return self.handled / self.duration
+
+    def percentile(self, p):
+        """
+        (float) -> float
+        Latency percentile 'p' (0-100), in seconds.
+        """
+        if not self.latencies:
+            return 0.0
+        index = min(len(self.latencies) - 1, int(round(p / 100.0 * (len(self.latencies) - 1))))
+        return self.latencies[index]
+
+    def __str__(self):
+        """
+        () -> str
+        Human readable representation for ReplayReport object
+        """
+        string = "Replayed %d updates (%d handled, %d errors) in %.3fs: %.1f msg/s\n" %(
+            self.updates, self.handled, self.errors, self.duration, self.throughput())
+        string += "Latency p50 %.2fms, p95 %.2fms, p99 %.2fms, max %.2fms\n" %(
+            self.percentile(50) * 1000, self.percentile(95) * 1000,
+            self.percentile(99) * 1000, self.percentile(100) * 1000)
+        string += "API calls: %s" %(", ".join("%s=%d" %item for item in sorted(self.api_calls.items())) or "none")
+        return string
+
+
+class Replayer:
+    """
+    Feeds a recording through Bot.processUpdate and a handler, as a poller would.
+
+        Attribute        Type        Description
+        filepath         string      recording file
+        handler          callable    called as handler(bot, message) for each message
+        bot              Bot         bot receiving the updates
+        api              FakeAPI     fake transport installed on the bot while run() runs
+        speed            float       1 replays in real time, N is N times faster, 0 as fast as possible
+        workers          int         number of threads calling the handler
+    """
+    def __init__(self, filepath, handler, bot=None, speed=0, workers=1, latency=0.0):
+        """
+        (str, callable, Bot, float, int, float) -> constructor
+        Replayer class constructor. Without a 'bot', a lazy Bot with a fake token is created.
+        During run(), the bot's API calls are answered by a FakeAPI with 'latency' seconds
+        per call; the bot's own transport is put back afterwards.
+        """
+        if bot is None:
+            from .bot import Bot
+            bot = Bot("REPLAY", lazy=True)
+        self.filepath = filepath
+        self.handler = handler
+        self.bot = bot
+        self.api = FakeAPI(latency)
+        self.speed = speed
+        self.workers = workers
+
+    def run(self):
+        """
+        () -> ReplayReport
+        Replay the whole recording and return the measurements.
+        """
+        transport = self.bot._transport
+        self.bot._transport = self.api
+        try:
+            return self._replay()
+        finally:
+            self.bot._transport = transport
+
+    def _replay(self):
+        latencies = []
+        counters = {"updates":0, "handled":0, "errors":0}
+        lock = threading.Lock()
+
+        def handle(message, due):
+            try:
+                self.bot.dispatch(self.handler, message)
+            except Exception:
+                logging.exception("Replayer: handler raised an exception.")
+                with lock:
+                    counters["errors"] += 1
+            with lock:
+                latencies.append(time.perf_counter() - due)
+                counters["handled"] += 1
+
+        executor = None
+        if self.workers > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="Replayer")
+
+        start = time.perf_counter()
+        firstReceived = None
+        for received, updateData in readRecording(self.filepath):
+            if firstReceived is None:
+                firstReceived = received
+            due = start
+            if self.speed:
+                due = start + (received - firstReceived) / self.speed
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            else:
+                due = time.perf_counter()
+
+            counters["updates"] += 1
+            message = self.bot.processUpdate(updateData)
+            if message is None:
+                continue
+            if executor is None:
+                handle(message, due)
+            else:
+                executor.submit(handle, message, due)
+
+        if executor is not None:
+            executor.shutdown(wait=True)
+        duration = time.perf_counter() - start
+        return ReplayReport(counters["updates"], counters["handled"], counters["errors"],
+                            duration, latencies, dict(self.api.calls))
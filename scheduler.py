@@ -0,0 +1,327 @@
+"""
+Delayed and recurring calls of Bot methods (reminders, periodic digests), without a
+thread per job. Jobs can be kept in a sqlite database so they survive restarts.
+"""
+
+from datetime import datetime, timedelta
+import heapq
+import itertools
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+
+from .types import Chat
+
+#due jobs taken from the queue at once
+BATCH_SIZE = 100
+
+_CRON_RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+
+def parseCron(spec):
+    """
+    (str) -> [set]
+    Parse a cron expression "minute hour day month weekday" (weekday 0 or 7 is Sunday).
+    Fields accept '*', numbers, ranges 'a-b', steps '*/n' or 'a-b/n' and lists 'a,b'.
+    As in cron, when both day and weekday are restricted, a time matching either of them matches.
+    """
+    fields = spec.split()
+    if len(fields) != 5:
+        raise ValueError("cron expression must have 5 fields: %r" %spec)
+    parsed = []
+    for field, (low, high) in zip(fields, _CRON_RANGES):
+        values = set()
+        for part in field.split(","):
+            step = 1
+            if "/" in part:
+                part, step = part.split("/")
+                step = int(step)
+            if part == "*":
+                start, end = low, high
+            elif "-" in part:
+                start, end = (int(value) for value in part.split("-"))
+            else:
+                start = end = int(part)
+            if start < low or end > high or start > end or step < 1:
+                raise ValueError("invalid cron field %r in %r" %(field, spec))
+            values.update(range(start, end + 1, step))
+        parsed.append(values)
+    if 7 in parsed[4]:
+        parsed[4].add(0)
+    return parsed
+
+
+def nextCron(cron, after):
+    """
+    ([set], datetime) -> datetime
+    First time strictly after 'after' matching a cron expression parsed by parseCron.
+    """
+    minutes, hours, days, months, weekdays = cron
+    #restricted day and weekday fields are alternatives ("1st of the month or Mondays")
+    either = not days.issuperset(range(1, 32)) and not weekdays.issuperset(range(7))
+    moment = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+    limit = moment + timedelta(days=366 * 5)
+    while moment < limit:
+        if moment.month not in months:
+            #first day of the next month
+            moment = (moment.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+        elif not _dayMatches(moment, days, weekdays, either):
+            moment = moment.replace(hour=0, minute=0) + timedelta(days=1)
+        elif moment.hour not in hours:
+            moment = moment.replace(minute=0) + timedelta(hours=1)
+        elif moment.minute not in minutes:
+            moment += timedelta(minutes=1)
+        else:
+            return moment
+    raise ValueError("cron expression never matches")
+
+
+def _dayMatches(moment, days, weekdays, either):
+    dayMatch = moment.day in days
+    weekdayMatch = (moment.isoweekday() % 7) in weekdays
+    if either:
+        return dayMatch or weekdayMatch
+    return dayMatch and weekdayMatch
+
+
+class Job:
+    """
+    A scheduled call of bot.<method>(to, *args, **kwargs).
+
+        Attribute        Type        Description
+        id               string      job identifier
+        due              float       next run, as a time.time() timestamp
+        method           string      name of the Bot method to call
+        chat             dict        destination, as {"id", "type"}
+        args             list        other positional arguments (JSON serializable)
+        kwargs           dict        keyword arguments (JSON serializable)
+        every            float       seconds between runs of a recurring job, or None
+        cron             string      cron expression of a recurring job, or None
+    """
+    def __init__(self, id, due, method, chat, args, kwargs, every=None, cron=None):
+        self.id = id
+        self.due = due
+        self.method = method
+        self.chat = chat
+        self.args = args
+        self.kwargs = kwargs
+        self.every = every
+        self.cron = cron
+
+    def nextDue(self, now):
+        """
+        (float) -> None/float
+        Time of the next run after 'now', None if the job does not repeat.
+        Runs missed while the bot was stopped are skipped.
+        """
+        if self.every is not None:
+            missed = max(0, int((now - self.due) // self.every))
+            return self.due + (missed + 1) * self.every
+        if self.cron is not None:
+            return nextCron(parseCron(self.cron), datetime.fromtimestamp(max(now, self.due))).timestamp()
+        return None
+
+    def __repr__(self):
+        return str(self.__dict__)
+
+
+class JobScheduler:
+    """
+    Runs jobs on a bot. Pending jobs are kept in a heap ordered by due time (O(log n)
+    insert); cancel is O(1), leaving a tombstone in the heap that is skipped when it
+    surfaces. A single thread waits for the next due time, takes all due jobs in batches
+    of 'batch_size' and queues them on the bot's send pool (see Bot.submit).
+    With a 'path', jobs are stored in that sqlite database and reloaded on start. A job
+    that runs once is deleted from it when its call finishes, so one still queued when
+    the process stops runs again on the next start.
+
+        Attribute        Type        Description
+        bot              Bot         bot running the jobs
+        path             string      sqlite database file, or None to keep jobs in memory only
+        batch_size       int         maximum number of due jobs taken at once
+        runs             int         number of job runs queued
+    """
+    def __init__(self, bot, path=None, batch_size=BATCH_SIZE):
+        """
+        (Bot, str, int) -> constructor
+        JobScheduler class constructor. Stored jobs are loaded here; call start() to run them.
+        """
+        self.bot = bot
+        self.path = path
+        self.batch_size = batch_size
+        self.runs = 0
+        self._jobs = {}
+        self._heap = []
+        self._sequence = itertools.count()
+        self._lock = threading.Condition()
+        self._thread = None
+        self._running = False
+        self._db = None
+        if path is not None:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, due REAL, method TEXT, "
+                             "chat TEXT, args TEXT, kwargs TEXT, every REAL, cron TEXT)")
+            self._db.commit()
+            with self._lock:
+                for row in self._db.execute("SELECT id, due, method, chat, args, kwargs, every, cron FROM jobs"):
+                    self._push(Job(row[0], row[1], row[2], json.loads(row[3]), json.loads(row[4]),
+                                   json.loads(row[5]), row[6], row[7]))
+            logging.info("JobScheduler: %d jobs loaded from %s" %(len(self._jobs), path))
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def schedule(self, when, method, to, *args, every=None, cron=None, **kwargs):
+        """
+        (float/datetime, str, User/Chat, ..., float, str, ...) -> str
+        Call bot.<method>(to, *args, **kwargs) at 'when' (a datetime, or a delay in seconds),
+        then every 'every' seconds or at each time matching the 'cron' expression if given.
+        'when' may be None for cron jobs (first matching time). Returns the job id.
+        With a database, arguments besides 'to' must be JSON serializable.
+        """
+        if cron is not None:
+            parseCron(cron)
+        now = time.time()
+        if isinstance(when, datetime):
+            due = when.timestamp()
+        elif when is None:
+            if cron is None:
+                raise ValueError("'when' is required for jobs without a cron expression")
+            due = nextCron(parseCron(cron), datetime.fromtimestamp(now)).timestamp()
+        else:
+            due = now + when
+        job = Job(uuid.uuid4().hex, due, method, {"id":to.id, "type":getattr(to, "type", "private")},
+                  list(args), kwargs, every, cron)
+        with self._lock:
+            self._store([job])
+            self._push(job)
+        return job.id
+
+    def cancel(self, jobId):
+        """
+        (str) -> bool
+        Cancel a job. Returns False if it does not exist (anymore).
+        """
+        with self._lock:
+            job = self._jobs.pop(jobId, None)
+            if job is None:
+                return False
+            if self._db is not None:
+                self._db.execute("DELETE FROM jobs WHERE id = ?", (jobId,))
+                self._db.commit()
+            #drop the tombstones once they are most of the heap
+            if len(self._heap) > 64 and len(self._heap) > 2 * len(self._jobs):
+                self._heap = [entry for entry in self._heap if self._jobs.get(entry[2]) is not None
+                              and self._jobs[entry[2]].due == entry[0]]
+                heapq.heapify(self._heap)
+            return True
+
+    def jobs(self):
+        """
+        () -> [Job]
+        Pending jobs, by due time.
+        """
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda job: job.due)
+
+    def start(self):
+        """
+        () -> None
+        Start running jobs.
+        """
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name="JobScheduler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """
+        () -> None
+        Stop running jobs. Pending jobs stay stored.
+        """
+        with self._lock:
+            self._running = False
+            self._lock.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _push(self, job):
+        #called with the lock held
+        self._jobs[job.id] = job
+        heapq.heappush(self._heap, (job.due, next(self._sequence), job.id))
+        self._lock.notify()
+
+    def _store(self, jobs):
+        #called with the lock held
+        if self._db is None or not jobs:
+            return
+        self._db.executemany("INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                             [(job.id, job.due, job.method, json.dumps(job.chat), json.dumps(job.args),
+                               json.dumps(job.kwargs), job.every, job.cron) for job in jobs])
+        self._db.commit()
+
+    def _takeDue(self, now):
+        #called with the lock held: pop up to batch_size due jobs and reschedule the recurring ones
+        batch = []
+        while self._heap and self._heap[0][0] <= now and len(batch) < self.batch_size:
+            due, sequence, jobId = heapq.heappop(self._heap)
+            job = self._jobs.get(jobId)
+            if job is None or job.due != due:
+                #cancelled, or an outdated entry of a rescheduled job
+                continue
+            batch.append(job)
+        if not batch:
+            return batch
+
+        #jobs running once stay stored until their call finishes (see _finished)
+        repeating = []
+        for job in batch:
+            nextDue = job.nextDue(now)
+            if nextDue is None:
+                del self._jobs[job.id]
+            else:
+                repeating.append(Job(job.id, nextDue, job.method, job.chat, job.args, job.kwargs,
+                                     job.every, job.cron))
+        self._store(repeating)
+        for job in repeating:
+            self._push(job)
+        return batch
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while self._running:
+                    wait = self._heap[0][0] - time.time() if self._heap else None
+                    if wait is not None and wait <= 0:
+                        break
+                    self._lock.wait(wait)
+                if not self._running:
+                    return
+                batch = self._takeDue(time.time())
+                self.runs += len(batch)
+            if batch:
+                logging.info("JobScheduler: Running %d due jobs." %len(batch))
+            for job in batch:
+                try:
+                    future = self.bot.submit(job.method, Chat(job.chat), *job.args, **job.kwargs)
+                except Exception:
+                    logging.exception("JobScheduler: could not queue job %s." %job.id)
+                    self._finished(job)
+                    continue
+                if job.every is None and job.cron is None:
+                    future.add_done_callback(lambda future, job=job: self._finished(job))
+
+    def _finished(self, job):
+        #a job running once is deleted from the database once its call is over
+        if self._db is None or job.every is not None or job.cron is not None:
+            return
+        with self._lock:
+            if job.id not in self._jobs:
+                self._db.execute("DELETE FROM jobs WHERE id = ?", (job.id,))
+                self._db.commit()
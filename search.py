@@ -0,0 +1,434 @@
+"""
+Full-text search over received messages ("where did user X mention Y").
+
+Messages are indexed incrementally in an in-memory segment; when it reaches
+'max_postings' entries it is frozen and, with a directory, written to disk as an
+immutable segment file read through mmap. Memory use is bounded by the segment size.
+
+Every query visits each segment, so segments are merged by size tiers: when the
+MERGE_FACTOR newest segments are of the same tier (a tier is MERGE_FACTOR times larger
+than the previous one), they are merged into one segment of the next tier. The number
+of segments then grows with the logarithm of the index size, until segments reach
+'max_merge_postings': larger ones are not merged again, so past that point it grows
+linearly, by one segment every max_merge_postings postings. A merge reads the merged
+segments into memory (about 4 bytes per posting) and rewrites them, with the index
+locked; each posting is rewritten once per tier.
+
+Segment file layout (little endian):
+    header      magic, document count, term count, offsets of the 3 tables, min and max date
+    documents   (chat id, user id, date, message id) as 4 int64 per document
+    terms       (text offset, text length, postings offset, postings count) per term, sorted by text
+    text        utf-8 terms, concatenated
+    postings    uint32 document numbers, increasing, for each term
+"""
+
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+
+from .middleware import Middleware
+
+#postings kept in memory before the segment is frozen (about 4 bytes each)
+MAX_POSTINGS = 1 << 20
+#segments kept in memory when there is no directory (older ones are dropped)
+MEMORY_SEGMENTS = 2
+#number of segments of a tier merged into one segment of the next tier
+MERGE_FACTOR = 4
+#segments are not merged past this many postings (bounds the memory used by a merge)
+MAX_MERGE_POSTINGS = 16 * MAX_POSTINGS
+
+_MAGIC = b"TGSEARCH"
+_HEADER = struct.Struct("<8sQQQQQqq")
+_DOCUMENT = struct.Struct("<qqqq")
+_TERM = struct.Struct("<QIQI")
+_WORD = re.compile(r"[^\W_]+", re.UNICODE)
+
+
+def tokenize(text):
+    """
+    (str) -> [str]
+    Lower case words of 'text'.
+    """
+    return _WORD.findall(text.casefold())
+
+
+def messageText(message):
+    """
+    (dict/Message) -> str
+    Searchable text of a raw message (as found in updates) or of a Message object:
+    text, caption and document file name. Both kinds are indexed the same way.
+    """
+    if isinstance(message, dict):
+        document = message.get("document") or {}
+        parts = [message.get("text"), message.get("caption"), document.get("file_name")]
+    else:
+        parts = [message.content if message.type == "text" else None, message.caption,
+                 message.content.file_name if message.type == "document" else None]
+    return " ".join(part for part in parts if part)
+
+
+class _MemorySegment:
+    def __init__(self):
+        self.documents = array("q")
+        self.postingsCount = 0
+        self.minDate = None
+        self.maxDate = None
+        self._postings = {}
+
+    def __len__(self):
+        return len(self.documents) // 4
+
+    def add(self, terms, chat_id, user_id, date, message_id):
+        number = len(self)
+        self.documents.extend( (chat_id, user_id, date, message_id) )
+        for term in terms:
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = array("I")
+            postings.append(number)
+        self.postingsCount += len(terms)
+        if self.minDate is None or date < self.minDate:
+            self.minDate = date
+        if self.maxDate is None or date > self.maxDate:
+            self.maxDate = date
+
+    def postings(self, term):
+        return self._postings.get(term, ())
+
+    def terms(self):
+        return self._postings.items()
+
+    def document(self, number):
+        return tuple(self.documents[number * 4:number * 4 + 4])
+
+    def extend(self, segment):
+        #append every document of 'segment', renumbered after the current ones
+        base = len(self)
+        self.documents.extend(segment.documentArray())
+        for term, postings in segment.terms():
+            merged = self._postings.get(term)
+            if merged is None:
+                merged = self._postings[term] = array("I")
+            merged.extend(number + base for number in postings)
+        self.postingsCount += segment.postingsCount
+        for date in (segment.minDate, segment.maxDate):
+            if self.minDate is None or date < self.minDate:
+                self.minDate = date
+            if self.maxDate is None or date > self.maxDate:
+                self.maxDate = date
+
+    def documentArray(self):
+        return self.documents
+
+    def write(self, path):
+        terms = sorted(self._postings)
+        encoded = [term.encode("utf-8") for term in terms]
+        documentsOffset = _HEADER.size
+        termsOffset = documentsOffset + len(self) * _DOCUMENT.size
+        textOffset = termsOffset + len(terms) * _TERM.size
+        postingsOffset = textOffset + sum(len(text) for text in encoded)
+
+        table = bytearray()
+        textPosition = 0
+        postingsPosition = 0
+        for term, text in zip(terms, encoded):
+            count = len(self._postings[term])
+            table += _TERM.pack(textPosition, len(text), postingsPosition, count)
+            textPosition += len(text)
+            postingsPosition += count * 4
+
+        temporary = path + ".tmp"
+        with open(temporary, "wb") as segmentFile:
+            segmentFile.write(_HEADER.pack(_MAGIC, len(self), len(terms), termsOffset, textOffset, postingsOffset,
+                                           self.minDate or 0, self.maxDate or 0))
+            segmentFile.write(self.documents.tobytes())
+            segmentFile.write(table)
+            for text in encoded:
+                segmentFile.write(text)
+            for term in terms:
+                segmentFile.write(self._postings[term].tobytes())
+            segmentFile.flush()
+            os.fsync(segmentFile.fileno())
+        os.replace(temporary, path)
+
+
+class _Terms:
+    #sorted term table of a disk segment, as a sequence of str for bisect
+    def __init__(self, segment):
+        self._segment = segment
+
+    def __len__(self):
+        return self._segment.termCount
+
+    def __getitem__(self, index):
+        textPosition, length, postingsPosition, count = self._segment.term(index)
+        start = self._segment.textOffset + textPosition
+        return bytes(self._segment.buffer[start:start + length]).decode("utf-8")
+
+
+class _DiskSegment:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as segmentFile:
+            self._mmap = mmap.mmap(segmentFile.fileno(), 0, access=mmap.ACCESS_READ)
+        self.buffer = memoryview(self._mmap)
+        (magic, self.count, self.termCount, self.termsOffset, self.textOffset, self.postingsOffset,
+         self.minDate, self.maxDate) = _HEADER.unpack_from(self.buffer, 0)
+        if magic != _MAGIC:
+            raise ValueError("%s is not a search segment" %path)
+        self._terms = _Terms(self)
+        self.postingsCount = (len(self._mmap) - self.postingsOffset) // 4
+
+    def __len__(self):
+        return self.count
+
+    def term(self, index):
+        return _TERM.unpack_from(self.buffer, self.termsOffset + index * _TERM.size)
+
+    def terms(self):
+        for index in range(self.termCount):
+            textPosition, length, postingsPosition, count = self.term(index)
+            start = self.postingsOffset + postingsPosition
+            yield self._terms[index], self.buffer[start:start + count * 4].cast("I")
+
+    def documentArray(self):
+        documents = array("q")
+        documents.frombytes(self.buffer[_HEADER.size:_HEADER.size + self.count * _DOCUMENT.size])
+        return documents
+
+    def postings(self, term):
+        index = bisect_left(self._terms, term)
+        if index == self.termCount or self._terms[index] != term:
+            return ()
+        textPosition, length, postingsPosition, count = self.term(index)
+        start = self.postingsOffset + postingsPosition
+        return self.buffer[start:start + count * 4].cast("I")
+
+    def document(self, number):
+        return _DOCUMENT.unpack_from(self.buffer, _HEADER.size + number * _DOCUMENT.size)
+
+    def close(self):
+        self.buffer.release()
+        self._mmap.close()
+
+
+def _segmentRange(name):
+    #numbers of the frozen segments a file holds: "00000007.seg", or "00000004_00000007.seg" once merged
+    if not name.endswith(".seg"):
+        return None
+    first, separator, last = name[:-4].partition("_")
+    return int(first), int(last or first)
+
+
+def _contains(postings, number):
+    index = bisect_left(postings, number)
+    return index < len(postings) and postings[index] == number
+
+
+class SearchIndex:
+    """
+    Incremental inverted index of text messages, captions and document file names.
+    All words of a query must match (AND); results can be filtered by chat, user and
+    date range and come newest first.
+
+        Attribute            Type        Description
+        directory            string      where frozen segments are written, or None to keep them in memory
+        max_postings         int         size of the in-memory segment, in postings
+        max_merge_postings   int         size from which disk segments are not merged anymore, in postings
+        documents            int         number of messages searchable
+        segments             int         number of frozen segments a query visits
+    """
+    def __init__(self, directory=None, max_postings=MAX_POSTINGS, max_merge_postings=MAX_MERGE_POSTINGS):
+        """
+        (str, int, int) -> constructor
+        SearchIndex class constructor. Segments already in 'directory' are opened.
+        Without a directory only the last MEMORY_SEGMENTS segments are kept.
+        """
+        self.directory = directory
+        self.max_postings = max_postings
+        self.max_merge_postings = max_merge_postings
+        self._segments = []
+        self._current = _MemorySegment()
+        self._lock = threading.RLock()
+        self._nextNumber = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            files = [(_segmentRange(name), name) for name in os.listdir(directory)
+                     if _segmentRange(name) is not None]
+            covered = -1
+            for (first, last), name in sorted(files, key=lambda item: (item[0][0], -item[0][1])):
+                if last <= covered:
+                    #left behind by a merge interrupted before it removed its sources
+                    os.remove(os.path.join(directory, name))
+                    continue
+                self._segments.append(_DiskSegment(os.path.join(directory, name)))
+                covered = last
+                self._nextNumber = last + 1
+            logging.info("SearchIndex: %d segments opened in %s" %(len(self._segments), directory))
+
+    @property
+    def documents(self):
+        with self._lock:
+            return sum(len(segment) for segment in self._segments) + len(self._current)
+
+    @property
+    def segments(self):
+        with self._lock:
+            return len(self._segments)
+
+    def add(self, message):
+        """
+        (Message) -> bool
+        Index a Message object. Returns False if it has no searchable text.
+        """
+        return self._add(messageText(message), message.chat.id, message.from_user.id,
+                         int(message.date.timestamp()), message.message_id)
+
+    def addMessageData(self, messageData):
+        """
+        (dict) -> bool
+        Index a raw message, as found in updates. Returns False if it has no searchable text.
+        """
+        return self._add(messageText(messageData), messageData["chat"]["id"],
+                         messageData.get("from", {}).get("id", 0), messageData["date"], messageData["message_id"])
+
+    def _add(self, text, chat_id, user_id, date, message_id):
+        terms = set(tokenize(text))
+        if not terms:
+            return False
+        with self._lock:
+            self._current.add(terms, chat_id, user_id, date, message_id)
+            if self._current.postingsCount >= self.max_postings:
+                self._freeze()
+        return True
+
+    def search(self, query, chat_id=None, user_id=None, since=None, until=None, limit=50):
+        """
+        (str, int, int, datetime, datetime, int) -> [dict]
+        Messages containing every word of 'query', newest first, as dicts with "chat_id",
+        "user_id", "message_id" and "date" (datetime). At most 'limit' results.
+        """
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        since = int(since.timestamp()) if since is not None else None
+        until = int(until.timestamp()) if until is not None else None
+        hits = []
+        with self._lock:
+            segments = self._segments + [self._current]
+            for segment in reversed(segments):
+                if len(segment) == 0:
+                    continue
+                if (since is not None and segment.maxDate < since) or (until is not None and segment.minDate > until):
+                    continue
+                lists = sorted((segment.postings(term) for term in terms), key=len)
+                if not lists[0]:
+                    continue
+                shortest, others = lists[0], lists[1:]
+                for position in range(len(shortest) - 1, -1, -1):
+                    number = shortest[position]
+                    if not all(_contains(postings, number) for postings in others):
+                        continue
+                    chat, user, date, message_id = segment.document(number)
+                    if chat_id is not None and chat != chat_id:
+                        continue
+                    if user_id is not None and user != user_id:
+                        continue
+                    if (since is not None and date < since) or (until is not None and date > until):
+                        continue
+                    hits.append({"chat_id":chat, "user_id":user, "message_id":message_id,
+                                 "date":datetime.fromtimestamp(date)})
+                    if len(hits) >= limit:
+                        return hits
+        return hits
+
+    def flush(self):
+        """
+        () -> None
+        Write the in-memory segment to the directory, so it survives a restart.
+        """
+        with self._lock:
+            if self.directory is not None and len(self._current):
+                self._freeze()
+
+    def close(self):
+        """
+        () -> None
+        Flush and close the segment files.
+        """
+        with self._lock:
+            self.flush()
+            for segment in self._segments:
+                if isinstance(segment, _DiskSegment):
+                    segment.close()
+            self._segments = []
+
+    def _freeze(self):
+        #called with the lock held
+        segment = self._current
+        self._current = _MemorySegment()
+        if self.directory is None:
+            self._segments.append(segment)
+            del self._segments[:-MEMORY_SEGMENTS]
+            return
+        path = os.path.join(self.directory, "%08d.seg" %self._nextNumber)
+        self._nextNumber += 1
+        segment.write(path)
+        self._segments.append(_DiskSegment(path))
+        logging.info("SearchIndex: Wrote %d messages to %s" %(len(segment), path))
+        while self._mergeTail():
+            pass
+
+    def _tier(self, segment):
+        tier = 0
+        size = self.max_postings * MERGE_FACTOR
+        while segment.postingsCount >= size:
+            tier += 1
+            size *= MERGE_FACTOR
+        return tier
+
+    def _mergeTail(self):
+        #called with the lock held: merge the newest MERGE_FACTOR segments if they share a tier
+        group = self._segments[-MERGE_FACTOR:]
+        if len(group) < MERGE_FACTOR or len({self._tier(segment) for segment in group}) != 1:
+            return False
+        if sum(segment.postingsCount for segment in group) > self.max_merge_postings:
+            return False
+        merged = _MemorySegment()
+        for segment in group:
+            merged.extend(segment)
+        first = _segmentRange(os.path.basename(group[0].path))[0]
+        last = _segmentRange(os.path.basename(group[-1].path))[1]
+        path = os.path.join(self.directory, "%08d_%08d.seg" %(first, last))
+        #the merged file is complete before its sources are removed (see __init__)
+        merged.write(path)
+        for segment in group:
+            segment.close()
+            os.remove(segment.path)
+        self._segments[-MERGE_FACTOR:] = [_DiskSegment(path)]
+        logging.info("SearchIndex: Merged %d segments into %s" %(len(group), path))
+        return True
+
+
+class IndexMessages(Middleware):
+    """
+    Middleware adding every incoming message to a SearchIndex, from the raw update.
+    """
+    def __init__(self, index):
+        """
+        (SearchIndex) -> constructor
+        IndexMessages class constructor.
+        """
+        self.index = index
+
+    def onUpdate(self, bot, updateData):
+        message = updateData.get("message")
+        if message is not None:
+            self.index.addMessageData(message)
+        return True
@@ -0,0 +1,144 @@
+"""
+Replies written incrementally (progress reports, generated text) by editing a message.
+"""
+
+import logging
+import threading
+import time
+
+from .errors import TelegramError
+
+#Telegram limit for the text of a message
+MAX_MESSAGE_LENGTH = 4096
+
+
+class StreamingReply:
+    """
+    A reply whose text grows over time. The first write is sent right away with
+    sendMessage; later writes are merged and applied with editMessageText, at most
+    one edit every 'min_interval' seconds, from a timer thread. Text longer than
+    'max_length' continues in a new message.
+    Use as a context manager, or call close() to send the final text.
+
+        Attribute        Type        Description
+        bot              Bot         bot sending the reply
+        to               User/Chat   destination
+        text             string      full text written so far
+        messages         [Message]   messages used by the reply, in order
+        min_interval     float       minimum time between two edits of a message, in seconds
+        edits            int         number of edits sent
+    """
+    def __init__(self, bot, to, replyTo=None, min_interval=1.0, max_length=MAX_MESSAGE_LENGTH):
+        """
+        (Bot, User/Chat, Message, float, int) -> constructor
+        StreamingReply class constructor. Nothing is sent before the first write.
+        """
+        self.bot = bot
+        self.to = to
+        self.replyTo = replyTo
+        self.min_interval = min_interval
+        self.max_length = max_length
+        self.text = ""
+        self.messages = []
+        self.edits = 0
+        #text currently shown by each message of 'messages'
+        self._shown = []
+        self._lastEdit = 0.0
+        self._interval = min_interval
+        self._timer = None
+        self._closed = False
+        self._started = False
+        #guards text, timer and closed; _sending serializes the requests of _flush
+        self._lock = threading.Lock()
+        self._sending = threading.Lock()
+
+    def write(self, chunk):
+        """
+        (string) -> None
+        Append 'chunk' to the reply.
+        """
+        with self._lock:
+            if self._closed:
+                raise ValueError("write to a closed StreamingReply")
+            self.text += chunk
+            first = not self._started
+            self._started = True
+            if not first and self._timer is None:
+                delay = max(0.0, self._lastEdit + self._interval - time.monotonic())
+                self._timer = threading.Timer(delay, self._onTimer)
+                self._timer.daemon = True
+                self._timer.start()
+        if first:
+            self._flush()
+
+    def close(self):
+        """
+        () -> [Message]
+        Send any pending text and return the messages of the reply.
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            closing = not self._closed
+            self._closed = True
+        if closing:
+            self._flush()
+        return self.messages
+
+    def _onTimer(self):
+        with self._lock:
+            self._timer = None
+            if self._closed:
+                return
+        self._flush()
+
+    def _flush(self):
+        #one flush at a time; the text is read under the lock, but the requests are made
+        #without it, so writers are not blocked by the network
+        with self._sending:
+            with self._lock:
+                text = self.text
+            if not text:
+                return
+            pieces = [text[start:start + self.max_length] for start in range(0, len(text), self.max_length)]
+            for index, piece in enumerate(pieces):
+                if index < len(self.messages):
+                    if self._shown[index] == piece:
+                        #Telegram refuses edits that do not change the text
+                        continue
+                    try:
+                        edited = self.bot.editMessageText(self.messages[index], piece)
+                    except TelegramError:
+                        edited = None
+                    self._lastEdit = time.monotonic()
+                    if edited is None:
+                        #slow down, the next write retries
+                        error = self.bot.lastError()
+                        if error is not None and error.retry_after:
+                            self._interval = max(self.min_interval, error.retry_after)
+                        else:
+                            self._interval = min(self._interval * 2, 60.0)
+                        logging.info("StreamingReply: edit failed, next edit in %.1fs." %self._interval)
+                        return
+                    self._interval = self.min_interval
+                    self._shown[index] = piece
+                    self.edits += 1
+                else:
+                    replyTo = self.replyTo if index == 0 else self.messages[-1]
+                    try:
+                        sent = self.bot.sendMessage(self.to, piece, replyTo=replyTo)
+                    except TelegramError:
+                        sent = None
+                    if sent is None:
+                        logging.warning("StreamingReply: could not send a message.")
+                        return
+                    self.messages.append(sent)
+                    self._shown.append(piece)
+                    self._lastEdit = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
@@ -0,0 +1,208 @@
+"""
+Inbound flood control: limits how many messages each user and each chat can send
+to the bot, before they are parsed or handled.
+"""
+
+import logging
+import threading
+import time
+
+from .middleware import Middleware
+from .types import Chat
+
+#what to do with messages over the limit
+DROP = "drop"
+DELAY = "delay"
+WARN = "warn"
+
+#a deferred message is let through if it is due within this many seconds (timer precision)
+TIMER_SLACK = 0.01
+
+DEFAULT_WARNING = "You are sending messages too fast. Some of them will be ignored."
+
+
+class SlidingCounter:
+    """
+    Approximate sliding window counters for many keys. Each key keeps the counts of the
+    current and previous fixed windows (a list of 4 numbers); the sliding count is the
+    current count plus the previous one weighted by how much of it is still in the window.
+    Keys idle for two windows are removed by sweep().
+
+        Attribute        Type        Description
+        window           float       window length, in seconds
+    """
+    def __init__(self, window):
+        """
+        (float) -> constructor
+        SlidingCounter class constructor.
+        """
+        self.window = window
+        #key -> [window index, previous count, current count, flag]
+        self._entries = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def hit(self, key, now):
+        """
+        (hashable, float) -> (float, list)
+        Count one event for 'key' and return the sliding count, including it, and the entry.
+        """
+        index = int(now // self.window)
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = [index, 0, 0, False]
+        elif entry[0] != index:
+            entry[1] = entry[2] if entry[0] == index - 1 else 0
+            entry[2] = 0
+            entry[0] = index
+        entry[2] += 1
+        elapsed = (now % self.window) / self.window
+        return entry[1] * (1.0 - elapsed) + entry[2], entry
+
+    def sweep(self, now):
+        """
+        (float) -> int
+        Remove the keys without events in the current and previous windows. Returns how many.
+        """
+        index = int(now // self.window)
+        stale = [key for key, entry in self._entries.items() if entry[0] < index - 1]
+        for key in stale:
+            del self._entries[key]
+        return len(stale)
+
+
+class FloodControl(Middleware):
+    """
+    Middleware limiting inbound messages to 'user_limit' per user and 'chat_limit' per
+    chat in any 'window' seconds. Counting and dropping happen on the raw update, so a
+    flood costs neither parsing nor handler time. Messages over the limit are:
+        "drop"      ignored;
+        "warn"      ignored, and the chat is told once (until the flood stops) with 'warning';
+        "delay"     handled late, when the rate is back under the limit: they are deferred
+                    (see Middleware.before) and handed to the handler again from a timer, so
+                    no handler worker waits. At most 'max_delayed' messages are delayed at
+                    once and none longer than 'max_delay' seconds; the others are dropped.
+                    Delayed messages may be handled after later ones.
+
+        Attribute        Type        Description
+        user_limit       int         messages allowed per user and window (None for no limit)
+        chat_limit       int         messages allowed per chat and window (None for no limit)
+        window           float       window length, in seconds
+        action           string      "drop", "warn" or "delay"
+        dropped          int         number of messages dropped
+        delayed          int         number of messages delayed
+        warned           int         number of warnings sent
+    """
+    def __init__(self, user_limit=20, chat_limit=None, window=60.0, action=DROP,
+                 warning=DEFAULT_WARNING, max_delay=10.0, max_delayed=2):
+        """
+        (int, int, float, str, str, float, int) -> constructor
+        FloodControl class constructor.
+        """
+        if action not in (DROP, DELAY, WARN):
+            raise ValueError("unknown flood control action %r" %action)
+        self.user_limit = user_limit
+        self.chat_limit = chat_limit
+        self.window = window
+        self.action = action
+        self.warning = warning
+        self.max_delay = max_delay
+        self.max_delayed = max_delayed
+        self.dropped = 0
+        self.delayed = 0
+        self.warned = 0
+        self._users = SlidingCounter(window)
+        self._chats = SlidingCounter(window)
+        self._nextSweep = 0.0
+        #(chat id, message id) -> (seconds to wait, time of arrival), for delayed messages
+        self._delays = {}
+        self._waiting = 0
+        self._lock = threading.Lock()
+
+    def onUpdate(self, bot, updateData):
+        """
+        (Bot, dict) -> bool
+        Count the message of the update and decide whether it goes through.
+        """
+        message = updateData.get("message")
+        if message is None:
+            return True
+        now = time.monotonic()
+        chat = message.get("chat", {})
+        with self._lock:
+            if now >= self._nextSweep:
+                self._users.sweep(now)
+                self._chats.sweep(now)
+                self._nextSweep = now + self.window
+            #the most exceeded limit decides
+            excess, limit, entry = 0.0, None, None
+            for counter, key, maxCount in ((self._users, message.get("from", {}).get("id"), self.user_limit),
+                                           (self._chats, chat.get("id"), self.chat_limit)):
+                if maxCount is None or key is None:
+                    continue
+                count, keyEntry = counter.hit(key, now)
+                if count <= maxCount:
+                    #back under the limit: warn again on the next flood
+                    keyEntry[3] = False
+                elif count - maxCount > excess:
+                    excess, limit, entry = count - maxCount, maxCount, keyEntry
+            if entry is None:
+                return True
+
+            if self.action == DELAY:
+                delay = self.window * excess / max(limit, 1)
+                if self._waiting >= self.max_delayed:
+                    self._forgetDelays(now)
+                if delay <= self.max_delay and self._waiting < self.max_delayed:
+                    self._delays[(chat.get("id"), message.get("message_id"))] = (delay, now)
+                    self._waiting += 1
+                    self.delayed += 1
+                    return True
+            warn = self.action == WARN and not entry[3]
+            if warn:
+                entry[3] = True
+                self.warned += 1
+            self.dropped += 1
+
+        if warn and "id" in chat:
+            logging.info("FloodControl: Warning chat %s." %chat["id"])
+            bot.submit("sendMessage", Chat(chat), self.warning)
+        return False
+
+    def before(self, bot, message):
+        """
+        (Bot, Message) -> bool
+        Defer delayed messages until their turn.
+        """
+        if not self._delays:
+            return True
+        key = (message.chat.id, message.message_id)
+        with self._lock:
+            delay = self._delays.get(key)
+            if delay is None:
+                return True
+            remaining = delay[0] + delay[1] - time.monotonic()
+            if remaining > TIMER_SLACK:
+                #the pipeline calls this again when the time is up
+                return remaining
+            del self._delays[key]
+            self._waiting -= 1
+        return True
+
+    def _forgetDelays(self, now):
+        #called with the lock held: delayed messages never passed to a handler
+        #(e.g. read with pollUpdates but not dispatched) must not hold their slot forever
+        stale = [key for key, (delay, since) in self._delays.items() if now - since > delay + self.window]
+        for key in stale:
+            del self._delays[key]
+        self._waiting -= len(stale)
+
+    def stats(self):
+        """
+        () -> dict
+        Counters of the actions taken and number of users and chats being tracked.
+        """
+        with self._lock:
+            return {"dropped":self.dropped, "delayed":self.delayed, "warned":self.warned,
+                    "users":len(self._users), "chats":len(self._chats)}
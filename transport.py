@@ -0,0 +1,195 @@
+"""
+HTTP transports used by Bot for every API call and download.
+
+A transport turns (url, parameters, files) into the decoded JSON answer. The default
+one uses requests with one keep-alive session shared by every thread; HTTPXTransport uses httpx
+(optional dependency) and can multiplex concurrent calls over one HTTP/2 connection.
+"""
+
+import threading
+
+from ._aux import LazyModule
+
+#requests takes most of the package import time, so it is only imported on first use
+requests = LazyModule("requests")
+
+#connections kept open to the API by RequestsTransport
+POOL_SIZE = 32
+
+
+class TransportError(Exception):
+    """
+    The request did not get a valid answer (connection error, timeout, invalid JSON).
+    """
+
+
+class Transport:
+    """
+    Interface of the HTTP transports. Subclasses implement call and download.
+    """
+    def call(self, url, parameters=None, files=None, post=False, timeout=None):
+        """
+        (str, dict, dict, bool, float) -> dict
+        Request 'url' with 'parameters' (query string, or form fields if 'post' is True)
+        and optional multipart 'files' ({field:(filename, data, mime_type)}), and return
+        the decoded JSON answer. Parameters set to None are left out.
+        Raises TransportError if there is no valid answer.
+        """
+        raise NotImplementedError
+
+    def download(self, url, chunk_size, timeout=None):
+        """
+        (str, int, float) -> (int, iterator)
+        Start a streamed GET of 'url' and return the HTTP status code and an iterator over
+        the body in chunks of about 'chunk_size' bytes (empty for error statuses).
+        Raises TransportError, also while iterating.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """
+        () -> None
+        Close the open connections.
+        """
+        pass
+
+
+def _withoutNone(parameters):
+    if parameters is None:
+        return None
+    return {key:value for key, value in parameters.items() if value is not None}
+
+
+def _uploadable(upload):
+    #httpx uploads bytes or file objects only: copy other buffers (bytearray, memoryview)
+    data = upload[1]
+    if not isinstance(data, bytes) and not hasattr(data, "read"):
+        data = bytes(data)
+    return (upload[0], data) + tuple(upload[2:])
+
+
+class RequestsTransport(Transport):
+    """
+    Transport based on requests. One Session is shared by every thread: plain requests
+    without cookies or changing settings are safe to make concurrently, and its
+    connection pool keeps up to 'pool_size' connections to the API open for reuse.
+
+        Attribute        Type        Description
+        pool_size        int         maximum number of idle connections kept per host
+    """
+    def __init__(self, pool_size=POOL_SIZE):
+        """
+        (int) -> constructor
+        RequestsTransport class constructor. The session is created on first use.
+        """
+        self.pool_size = pool_size
+        self._client = None
+        self._lock = threading.Lock()
+
+    def _session(self):
+        session = self._client
+        if session is None:
+            with self._lock:
+                if self._client is None:
+                    session = requests.Session()
+                    #the default pool keeps 10 connections: more concurrent calls would reconnect
+                    adapter = requests.adapters.HTTPAdapter(pool_maxsize=self.pool_size)
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    self._client = session
+                session = self._client
+        return session
+
+    def call(self, url, parameters=None, files=None, post=False, timeout=None):
+        try:
+            if post:
+                response = self._session().post(url, data=parameters, files=files, timeout=timeout)
+            else:
+                response = self._session().get(url, params=parameters, timeout=timeout)
+            return response.json()
+        except (requests.exceptions.RequestException, ValueError) as error:
+            raise TransportError(str(error))
+
+    def download(self, url, chunk_size, timeout=None):
+        try:
+            response = self._session().get(url, stream=True, timeout=timeout)
+        except requests.exceptions.RequestException as error:
+            raise TransportError(str(error))
+        if response.status_code >= 400:
+            response.close()
+            return response.status_code, iter(())
+        return response.status_code, self._chunks(response, chunk_size)
+
+    def _chunks(self, response, chunk_size):
+        try:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                yield chunk
+        except requests.exceptions.RequestException as error:
+            raise TransportError(str(error))
+        finally:
+            response.close()
+
+    def close(self):
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+
+class HTTPXTransport(Transport):
+    """
+    Transport based on httpx (pip install httpx[http2]). One thread safe client is
+    shared by every thread; with 'http2' the calls made at the same time travel as
+    concurrent streams of a single connection instead of one connection each.
+    Set 'http1' False to speak HTTP/2 without TLS negotiation (plain http:// servers).
+
+        Attribute        Type        Description
+        http2            bool        True if HTTP/2 is enabled
+    """
+    def __init__(self, http2=True, http1=True, max_connections=10):
+        """
+        (bool, bool, int) -> constructor
+        HTTPXTransport class constructor. Raises ImportError if httpx (or h2, for HTTP/2)
+        is not installed.
+        """
+        import httpx
+        self._httpx = httpx
+        self.http2 = http2
+        self._client = httpx.Client(http1=http1, http2=http2,
+                                    limits=httpx.Limits(max_connections=max_connections))
+
+    def call(self, url, parameters=None, files=None, post=False, timeout=None):
+        httpx = self._httpx
+        try:
+            if post:
+                if files is not None:
+                    files = {name:_uploadable(upload) for name, upload in files.items()}
+                response = self._client.post(url, data=_withoutNone(parameters), files=files, timeout=timeout)
+            else:
+                response = self._client.get(url, params=_withoutNone(parameters), timeout=timeout)
+            return response.json()
+        except (httpx.HTTPError, ValueError) as error:
+            raise TransportError(str(error))
+
+    def download(self, url, chunk_size, timeout=None):
+        httpx = self._httpx
+        try:
+            response = self._client.send(self._client.build_request("GET", url, timeout=timeout), stream=True)
+        except httpx.HTTPError as error:
+            raise TransportError(str(error))
+        if response.status_code >= 400:
+            response.close()
+            return response.status_code, iter(())
+        return response.status_code, self._chunks(response, chunk_size)
+
+    def _chunks(self, response, chunk_size):
+        try:
+            for chunk in response.iter_bytes(chunk_size=chunk_size):
+                yield chunk
+        except self._httpx.HTTPError as error:
+            raise TransportError(str(error))
+        finally:
+            response.close()
+
+    def close(self):
+        self._client.close()
@@ -0,0 +1,118 @@
+"""
+Background upload pool for the Bot class.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+from .types import InputFile, InputMedia
+
+
+def uploadSize(args, kwargs):
+    """
+    (tuple, dict) -> None/int
+    Total size in bytes of the files to upload among a call's arguments
+    (InputFile, InputMedia or lists of them). Returns None if nothing is uploaded.
+    Files of unknown size count as 0 bytes.
+    """
+    total = None
+    values = list(args) + list(kwargs.values())
+    while values:
+        value = values.pop()
+        if isinstance(value, (list, tuple)):
+            values.extend(value)
+            continue
+        if isinstance(value, InputMedia):
+            value = value.media
+        if isinstance(value, InputFile):
+            total = (total or 0) + (value.size() or 0)
+    return total
+
+
+class BandwidthLimiter:
+    """
+    Token bucket shared by every upload of a pool. Each upload is charged its size
+    before it starts, so the average upload rate stays below 'rate' bytes per second.
+
+        Attribute        Type        Description
+        rate             float       allowed bytes per second
+        burst            float       bytes that can be sent at once after an idle period
+    """
+    def __init__(self, rate, burst=None):
+        """
+        (float, float) -> constructor
+        BandwidthLimiter class constructor. 'burst' defaults to one second worth of bytes.
+        """
+        self.rate = float(rate)
+        if burst is None:
+            burst = rate
+        self.burst = float(burst)
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, nbytes):
+        """
+        (int) -> float
+        Charge 'nbytes' to the bucket, sleeping if the bucket is in debt.
+        Returns the time waited, in seconds.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            self._tokens -= nbytes
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class UploadPool:
+    """
+    Bounded thread pool for large uploads, with its own concurrency and optional
+    bandwidth limits.
+
+        Attribute        Type                Description
+        max_workers      int                 maximum number of simultaneous uploads
+        limiter          BandwidthLimiter    None if the bandwidth is not limited
+        pending          int                 number of submitted uploads not finished yet
+    """
+    def __init__(self, max_workers=2, max_bandwidth=None):
+        """
+        (int, float) -> constructor
+        UploadPool class constructor. 'max_bandwidth' is in bytes per second.
+        """
+        self.max_workers = max_workers
+        self.limiter = None
+        if max_bandwidth:
+            self.limiter = BandwidthLimiter(max_bandwidth)
+        self.pending = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="BotUpload")
+
+    def submit(self, nbytes, function, *args, **kwargs):
+        """
+        (int, callable, ...) -> Future
+        Run function(*args, **kwargs) on the pool once 'nbytes' fit in the bandwidth limit.
+        """
+        with self._lock:
+            self.pending += 1
+        return self._executor.submit(self._run, nbytes, function, args, kwargs)
+
+    def _run(self, nbytes, function, args, kwargs):
+        try:
+            if self.limiter is not None and nbytes:
+                self.limiter.acquire(nbytes)
+            return function(*args, **kwargs)
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+    def shutdown(self, wait=True):
+        """
+        (bool) -> None
+        Stop accepting uploads. If 'wait' is True, block until pending uploads finish.
+        """
+        self._executor.shutdown(wait=wait)